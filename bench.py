@@ -0,0 +1,274 @@
+"""
+Benchmarks for the hot paths of zipfile.py.
+
+Each workload runs in its own process (so peak RSS means something) and
+reports calculate_size() latency, iter() throughput and chunk rate, the
+time for write_to() a file, and the same archive written by the standard
+library's zipfile for comparison.
+
+    python bench.py                     # Everything, at full size.
+    python bench.py --quick tiny large  # Some of it, 100x smaller.
+
+"""
+import argparse
+import imp
+import json
+import os
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import zlib
+
+here = os.path.dirname(os.path.abspath(__file__))
+
+# This directory's zipfile.py shadows the standard library's, so import that
+# without us on the path, and ours under another name.
+_path = sys.path
+sys.path = [x for x in sys.path if os.path.realpath(x or os.curdir) != here]
+sys.modules.pop('zipfile', None)
+import zipfile as stdlib_zipfile
+sys.path = _path
+zipseer = imp.load_source('zipseer', os.path.join(here, 'zipfile.py'))
+
+
+MB = 1024 * 1024
+
+TINY_DATA = 'x' * 100
+TINY_CRC = zlib.crc32(TINY_DATA) & 0xffffffff
+
+
+def make_tiny(args, tmp):
+    """Many tiny function-sourced members with known CRCs."""
+    z = zipseer.ZipFile(compact=args.compact)
+    func = lambda: TINY_DATA
+    for i in xrange(args.tiny_count):
+        info = zipseer.ZipInfo('tiny/%07d.txt' % i, source_func=func,
+            compress_size=len(TINY_DATA), crc=TINY_CRC)
+        z.add(info)
+    return z
+
+
+def make_zip64_count(args, tmp):
+    """Enough empty members to need ZIP64 end records."""
+    z = zipseer.ZipFile(compact=args.compact)
+    func = lambda: ''
+    for i in xrange(zipseer.MAX_16BIT + 1000):
+        z.add(zipseer.ZipInfo('empty/%07d' % i, source_func=func, compress_size=0, crc=0))
+    return z
+
+
+def _zero_crc(size):
+    CRC = 0
+    chunk = '\0' * MB
+    for i in xrange(size // MB):
+        CRC = zlib.crc32(chunk, CRC)
+    return zlib.crc32('\0' * (size % MB), CRC) & 0xffffffff
+
+
+def make_large(args, tmp):
+    """A few multi-GB (sparse) files with known CRCs."""
+    z = zipseer.ZipFile()
+    crc = _zero_crc(args.large_size)
+    for i in xrange(args.large_count):
+        path = os.path.join(tmp, 'large-%d.bin' % i)
+        with open(path, 'wb') as fh:
+            fh.truncate(args.large_size)
+        z.add_from_path(path, arcname='large-%d.bin' % i, crc=crc)
+    return z
+
+
+def _make_medium_files(args, tmp):
+    paths = []
+    data = os.urandom(MB)
+    for i in xrange(args.medium_count):
+        path = os.path.join(tmp, 'medium-%d.bin' % i)
+        with open(path, 'wb') as fh:
+            for j in xrange(args.medium_size // MB):
+                fh.write(data)
+        paths.append(path)
+    return paths
+
+
+def make_known_crc(args, tmp):
+    """Medium files whose CRCs are known up front."""
+    z = zipseer.ZipFile()
+    for path in _make_medium_files(args, tmp):
+        info = z.add_from_path(path, arcname=os.path.basename(path))
+        info.compute_crc()
+    return z
+
+
+def make_data_descriptor(args, tmp):
+    """Medium files whose CRCs are computed while streaming."""
+    z = zipseer.ZipFile()
+    for path in _make_medium_files(args, tmp):
+        z.add_from_path(path, arcname=os.path.basename(path))
+    return z
+
+
+def make_precompressed(args, tmp):
+    """Members given as already deflated data."""
+    z = zipseer.ZipFile()
+    raw = '\0' * args.medium_size
+    data = ''.join(zipseer.iter_deflate([raw]))
+    crc = zlib.crc32(raw) & 0xffffffff
+    for i in xrange(args.medium_count):
+        z.add_from_func(lambda: data, len(data), 'null-%d.txt' % i,
+            compress_type=zipseer.COMPRESSION_DEFLATE, file_size=len(raw), crc=crc)
+    return z
+
+
+WORKLOADS = [
+    ('tiny', make_tiny),
+    ('zip64-count', make_zip64_count),
+    ('large', make_large),
+    ('known-crc', make_known_crc),
+    ('data-descriptor', make_data_descriptor),
+    ('precompressed', make_precompressed),
+]
+
+
+def write_stdlib(z, path):
+    """Write the same members with the standard library, stored."""
+    out = stdlib_zipfile.ZipFile(path, 'w', stdlib_zipfile.ZIP_STORED, allowZip64=True)
+    for info in z.infos:
+        if info.compress_type != zipseer.COMPRESSION_NONE:
+            return False # It can't take pre-compressed data.
+        if info.source_path:
+            out.write(info.source_path, info.filename)
+        else:
+            out.writestr(info.filename, ''.join(info._iter_source_func()))
+    out.close()
+    return True
+
+
+def run_one(name, args):
+
+    tmp = tempfile.mkdtemp(prefix='zipseer-bench-')
+    try:
+
+        start = time.time()
+        z = dict(WORKLOADS)[name](args, tmp)
+        build_time = time.time() - start
+
+        start = time.time()
+        size = z.calculate_size()
+        size_time = time.time() - start
+
+        chunks = 0
+        total = 0
+        start = time.time()
+        for chunk in z.iter():
+            chunks += 1
+            total += len(chunk)
+        iter_time = time.time() - start
+        assert total == size, (total, size)
+        # Before the second build and the stdlib writer can raise the peak.
+        peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+        out_path = os.path.join(tmp, 'out.zip')
+        z = dict(WORKLOADS)[name](args, tmp)
+        z.calculate_size()
+        start = time.time()
+        with open(out_path, 'wb') as fh:
+            z.write_to(fh)
+        write_time = time.time() - start
+        os.unlink(out_path)
+
+        stdlib_time = None
+        if not args.no_stdlib:
+            start = time.time()
+            if write_stdlib(z, out_path):
+                stdlib_time = time.time() - start
+
+        return dict(
+            name=name,
+            members=len(z.infos),
+            size=size,
+            build=build_time,
+            calculate_size=size_time,
+            iter_mbps=size / float(MB) / iter_time if iter_time else None,
+            chunks_per_sec=chunks / iter_time if iter_time else None,
+            write_to=write_time,
+            stdlib=stdlib_time,
+            peak_rss_mb=peak_rss / 1024.0,
+        )
+
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+
+
+def format_result(r):
+    def f(x, fmt):
+        return '-' if x is None else fmt % x
+    return '%-16s %9d %10.1f %9s %9s %11s %9s %9s %9.1f' % (
+        r['name'], r['members'], r['size'] / float(MB),
+        f(r['calculate_size'], '%.3f'),
+        f(r['iter_mbps'], '%.1f'),
+        f(r['chunks_per_sec'], '%.0f'),
+        f(r['write_to'], '%.2f'),
+        f(r['stdlib'], '%.2f'),
+        r['peak_rss_mb'],
+    )
+
+HEADER = '%-16s %9s %10s %9s %9s %11s %9s %9s %9s' % (
+    'workload', 'members', 'MB', 'size (s)', 'iter MB/s', 'chunks/s',
+    'write (s)', 'stdlib (s)', 'RSS MB')
+
+
+def main():
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--quick', action='store_true', help="Make everything 100x smaller.")
+    parser.add_argument('--compact', action='store_true', help="Use ZipFile(compact=True) where possible.")
+    parser.add_argument('--no-stdlib', action='store_true', help="Skip the standard library baseline.")
+    parser.add_argument('--tiny-count', type=int, default=1000000)
+    parser.add_argument('--large-count', type=int, default=3)
+    parser.add_argument('--large-size', type=int, default=4 * 1024 * MB)
+    parser.add_argument('--medium-count', type=int, default=32)
+    parser.add_argument('--medium-size', type=int, default=32 * MB)
+    parser.add_argument('-o', '--output', help="Also append JSON results to this file.")
+    parser.add_argument('--run-one', help=argparse.SUPPRESS)
+    parser.add_argument('workloads', nargs='*', help="Any of: %s" % ', '.join(n for n, _ in WORKLOADS))
+    args = parser.parse_args()
+
+    if args.quick:
+        args.tiny_count //= 100
+        args.large_size //= 100
+        args.medium_size = max(MB, args.medium_size // 100)
+
+    if args.run_one:
+        print json.dumps(run_one(args.run_one, args))
+        return
+
+    names = args.workloads or [n for n, _ in WORKLOADS]
+    for name in names:
+        if name not in dict(WORKLOADS):
+            parser.error("Unknown workload %r." % name)
+
+    # Pass the options along to each child, minus the workloads.
+    argv = [x for x in sys.argv[1:] if x not in names]
+    if args.quick and '--quick' in argv:
+        argv.remove('--quick')
+        argv.extend([
+            '--tiny-count', str(args.tiny_count),
+            '--large-size', str(args.large_size),
+            '--medium-size', str(args.medium_size),
+        ])
+
+    print HEADER
+    for name in names:
+        out = subprocess.check_output([sys.executable, __file__, '--run-one', name] + argv)
+        result = json.loads(out.strip().splitlines()[-1])
+        print format_result(result)
+        sys.stdout.flush()
+        if args.output:
+            with open(args.output, 'a') as fh:
+                fh.write(json.dumps(result) + '\n')
+
+
+if __name__ == '__main__':
+    main()
@@ -3,9 +3,21 @@ Read and write ZIP files.
 """
 import struct, os, time, sys
 import binascii, stat
+import fnmatch
 import io
+import Queue
 import re
 import string
+import bisect
+import itertools
+import threading
+import shutil
+import tempfile
+from array import array
+import collections
+from collections import OrderedDict
+from cStringIO import StringIO
+from multiprocessing.pool import Pool, ThreadPool
 
 try:
     import zlib # We may need its compression method
@@ -14,8 +26,29 @@ except ImportError:
     zlib = None
     crc32 = binascii.crc32
 
+try:
+    sendfile = os.sendfile # Lets the kernel copy file bodies for us.
+except AttributeError:
+    sendfile = None
+
+try:
+    posix_fallocate = os.posix_fallocate # Reserves the whole output at once.
+except AttributeError:
+    posix_fallocate = None
+
+try:
+    from os import scandir
+except ImportError:
+    try:
+        from scandir import scandir # The backport, for Python 2.
+    except ImportError:
+        scandir = None
+
 __all__ = ["COMPRESSION_NONE", "COMPRESSION_DEFLATE",
-           "ZipInfo", "ZipFile"]
+           "ZipInfo", "ZipFile", "ZipStream", "CRCCache", "SQLiteCRCCache",
+           "DeflateCache", "MemberTable", "ManifestTable",
+           "IterHooks", "StatsHooks", "MemberStats", "ZipReader",
+           "ArchivePart", "IOService", "CompressionPolicy"]
 
 MAX_32BIT = (1 << 32) - 1
 MAX_16BIT = (1 << 16) - 1
@@ -58,15 +91,1099 @@ stringEndArchive64Locator = 'PK\x06\x07'
 structEndArchive64 = '<4sQ2H2L4Q'
 stringEndArchive64 = 'PK\x06\x06'
 
-
-def iter_deflate(source):
+# Compiled once, since we pack these for every member.
+_EndArchive = struct.Struct(structEndArchive)
+_CentralDir = struct.Struct(structCentralDir)
+_FileHeader = struct.Struct(structFileHeader)
+_DataDescriptor = struct.Struct(structDataDescriptor)
+_DataDescriptor64 = struct.Struct(structDataDescriptor64)
+_EndArchive64Locator = struct.Struct(structEndArchive64Locator)
+_EndArchive64 = struct.Struct(structEndArchive64)
+
+# ZIP64 "extra" fields holding 0 to 3 values.
+_Zip64Extras = [struct.Struct('<HH' + 'Q' * i) for i in xrange(4)]
+
+# Fixed sizes of the above, so layouts can be computed without packing.
+sizeEndCentDir = _EndArchive.size
+sizeCentralDir = _CentralDir.size
+sizeFileHeader = _FileHeader.size
+sizeDataDescriptor = _DataDescriptor.size
+sizeDataDescriptor64 = _DataDescriptor64.size
+sizeEndCentDir64Locator = _EndArchive64Locator.size
+sizeEndCentDir64 = _EndArchive64.size
+sizeZip64Extra = _Zip64Extras[2].size
+
+
+def iter_deflate(source, level=-1):
     """If you need to compress something."""
-    compressor = zlib.compressobj(zlib.Z_DEFAULT_COMPRESSION, zlib.DEFLATED, -15)
+    compressor = zlib.compressobj(level, zlib.DEFLATED, -15)
     for x in source:
         yield compressor.compress(x)
     yield compressor.flush()
 
 
+def _deflate(source, level=-1):
+    """Deflate all of ``source``, returning ``(data, crc, file_size)``."""
+    CRC = 0
+    size = 0
+    out = []
+    compressor = zlib.compressobj(level, zlib.DEFLATED, -15)
+    for chunk in source:
+        size += len(chunk)
+        CRC = crc32(chunk, CRC) & 0xffffffff
+        out.append(compressor.compress(chunk))
+    out.append(compressor.flush())
+    return ''.join(out), CRC, size
+
+
+def _gf2_matrix_times(mat, vec):
+    total = 0
+    i = 0
+    while vec:
+        if vec & 1:
+            total ^= mat[i]
+        vec >>= 1
+        i += 1
+    return total
+
+
+def _gf2_matrix_square(mat):
+    return [_gf2_matrix_times(mat, mat[n]) for n in xrange(32)]
+
+
+_crc32_shifts = {}
+
+def _crc32_shift(length):
+    """The GF(2) operator appending ``length`` zero bytes to a CRC-32."""
+    mat = _crc32_shifts.get(length)
+    if mat is not None:
+        return mat
+    # Operators for one zero bit, then 2, 4, 8... zero bytes by squaring.
+    op = [0xedb88320] + [1 << n for n in xrange(31)]
+    op = _gf2_matrix_square(_gf2_matrix_square(_gf2_matrix_square(op)))
+    mat = None
+    n = length
+    while n:
+        if n & 1:
+            mat = op if mat is None else [_gf2_matrix_times(op, x) for x in mat]
+        n >>= 1
+        if n:
+            op = _gf2_matrix_square(op)
+    if len(_crc32_shifts) < 64:
+        _crc32_shifts[length] = mat
+    return mat
+
+
+def crc32_combine(crc1, crc2, length2):
+    """Return the CRC-32 of ``a + b`` from those of ``a`` and of ``b``.
+
+    ``length2`` is ``len(b)``. Like zlib's function of the same name, which
+    Python's zlib module doesn't expose.
+
+    """
+    if length2 <= 0:
+        return crc1
+    return _gf2_matrix_times(_crc32_shift(length2), crc1) ^ crc2
+
+
+def _deflate_block(block, level):
+    # Flushed to a byte boundary and without a final block, so that blocks
+    # compressed independently concatenate into one raw deflate stream.
+    compressor = zlib.compressobj(level, zlib.DEFLATED, -15)
+    data = compressor.compress(block) + compressor.flush(zlib.Z_SYNC_FLUSH)
+    return data, crc32(block) & 0xffffffff, len(block)
+
+
+def _deflate_parallel(blocks, out, level=-1, workers=None):
+    """Deflate each of ``blocks`` on a thread pool, writing to the file ``out``.
+
+    zlib releases the GIL while compressing, so this uses several cores for
+    one member, and only a few blocks are in memory at a time. Returns
+    ``(compress_size, crc, file_size)``. The result is a little larger than
+    :func:`_deflate`'s, as each block starts without the previous one as
+    history.
+
+    """
+    pool = ThreadPool(workers)
+    try:
+        pending = collections.deque()
+        limit = 2 * len(pool._pool)
+        compress_size = 0
+        CRC = 0
+        size = 0
+        blocks = iter(blocks)
+        while True:
+            for block in itertools.islice(blocks, limit - len(pending)):
+                pending.append(pool.apply_async(_deflate_block, (block, level)))
+            if not pending:
+                break
+            data, block_crc, length = pending.popleft().get()
+            out.write(data)
+            compress_size += len(data)
+            CRC = crc32_combine(CRC, block_crc, length)
+            size += length
+    finally:
+        pool.terminate()
+        pool.join()
+    data = zlib.compressobj(level, zlib.DEFLATED, -15).flush()
+    out.write(data)
+    return compress_size + len(data), CRC, size
+
+
+# Arrays of offsets and sizes need 64 bits, but array('L') is only 32 bits
+# wide on some platforms (e.g. Windows), and Python 2 has no array('Q').
+if array('L').itemsize >= 8:
+    def _uint64_array(values=()):
+        return array('L', values)
+else:
+    _uint64_array = list
+
+
+def _iter_file(path, chunk_size=1024 * 1024, offset=0, length=None):
+    """Yield ``length`` bytes (or all) of the file at ``path`` from ``offset``."""
+    with open(path, 'rb') as fh:
+        if offset:
+            fh.seek(offset)
+        while length is None or length > 0:
+            chunk = fh.read(chunk_size if length is None else min(chunk_size, length))
+            if not chunk:
+                return
+            if length is not None:
+                length -= len(chunk)
+            yield chunk
+
+
+def _deflate_path(args):
+    # A top-level function so it can run in a process pool.
+    path, level = args
+    return _deflate(_iter_file(path), level)
+
+
+def _write_all(fd, data):
+    """Write all of ``data`` to ``fd``, looping over partial writes."""
+    view = memoryview(data)
+    while view:
+        view = view[os.write(fd, view):]
+
+
+def _iter_slice(chunks, start, end):
+    """Yield the ``[start, end)`` slice of the stream formed by ``chunks``."""
+    pos = 0
+    for chunk in chunks:
+        next_pos = pos + len(chunk)
+        if chunk and next_pos > start:
+            yield chunk[max(start - pos, 0):end - pos]
+        pos = next_pos
+        if pos >= end:
+            return
+
+
+class _DirEntry(object):
+    """Enough of ``os.DirEntry`` for :meth:`ZipFile.add_tree` without scandir.
+
+    Both ``stat`` results are cached, and unless the entry is a symlink they
+    are the same one, from a single ``os.lstat``.
+
+    """
+
+    __slots__ = ('name', 'path', '_stat', '_lstat')
+
+    def __init__(self, dir_path, name):
+        self.name = name
+        self.path = os.path.join(dir_path, name)
+        self._stat = None
+        self._lstat = None
+
+    def stat(self, follow_symlinks=True):
+        if self._lstat is None:
+            self._lstat = os.lstat(self.path)
+        if not follow_symlinks:
+            return self._lstat
+        if self._stat is None:
+            if stat.S_ISLNK(self._lstat.st_mode):
+                self._stat = os.stat(self.path)
+            else:
+                self._stat = self._lstat
+        return self._stat
+
+    def is_dir(self, follow_symlinks=True):
+        try:
+            st = self.stat(follow_symlinks)
+        except OSError:
+            return False
+        return stat.S_ISDIR(st.st_mode)
+
+
+def _scandir(path):
+    if scandir is not None:
+        return list(scandir(path))
+    return [_DirEntry(path, name) for name in os.listdir(path)]
+
+
+def _entry_stat(entry):
+    return entry.stat()
+
+
+def _entry_lstat(entry):
+    try:
+        entry.stat(follow_symlinks=False)
+    except OSError:
+        pass
+
+
+def _entry_stat_policy(args):
+    entry, policy = args
+    st = entry.stat()
+    if stat.S_ISDIR(st.st_mode):
+        return st, COMPRESSION_NONE
+    return st, policy.choose(entry.path, st)
+
+
+def _match_any(name, patterns):
+    if isinstance(patterns, basestring):
+        patterns = (patterns, )
+    for pattern in patterns:
+        if fnmatch.fnmatchcase(name, pattern):
+            return True
+    return False
+
+
+def _stat_mtime_ns(st):
+    try:
+        return st.st_mtime_ns
+    except AttributeError:
+        return int(st.st_mtime * 1e9)
+
+
+class CompressionPolicy(object):
+    """Decides, per source file, whether deflating it is worth the CPU.
+
+    Files with a known extension are decided by it; others have their first
+    ``sample_size`` bytes deflated (quickly, at ``level``), and are deflated
+    if that shrinks them to less than ``threshold`` of their size. Files
+    smaller than ``min_size`` are always stored. Install one as
+    :attr:`ZipFile.compression_policy`.
+
+    Members it decides to deflate have no ``file_size`` until they are
+    compressed, so with a policy installed, call :meth:`ZipFile.precompress`
+    before :meth:`ZipFile.calculate_size`; otherwise that raises ``"file_size
+    required if content is compressed"``.
+
+    """
+
+    # Formats which are already compressed.
+    store_extensions = frozenset([
+        '.7z', '.apk', '.avi', '.bz2', '.docx', '.epub', '.flac', '.gif',
+        '.gz', '.heic', '.jar', '.jpeg', '.jpg', '.m4a', '.mkv', '.mov',
+        '.mp3', '.mp4', '.odt', '.ogg', '.png', '.pptx', '.rar', '.tgz',
+        '.webm', '.webp', '.whl', '.xlsx', '.xz', '.zip', '.zst',
+    ])
+
+    # Formats which are (almost) always text.
+    deflate_extensions = frozenset([
+        '.c', '.cfg', '.css', '.csv', '.h', '.htm', '.html', '.ini', '.js',
+        '.json', '.log', '.md', '.py', '.rst', '.sql', '.svg', '.tsv',
+        '.txt', '.xml', '.yaml', '.yml',
+    ])
+
+    def __init__(self, threshold=0.9, sample_size=64 * 1024, min_size=512, level=1):
+        self.threshold = threshold
+        self.sample_size = sample_size
+        self.min_size = min_size
+        self.level = level
+
+    def choose(self, path, st=None):
+        """Return ``COMPRESSION_DEFLATE`` or ``COMPRESSION_NONE`` for ``path``."""
+
+        if st is None:
+            st = os.stat(path)
+        if zlib is None or st.st_size < self.min_size:
+            return COMPRESSION_NONE
+
+        ext = os.path.splitext(path)[1].lower()
+        if ext in self.store_extensions:
+            return COMPRESSION_NONE
+        if ext in self.deflate_extensions:
+            return COMPRESSION_DEFLATE
+
+        if self.estimate(path) < self.threshold:
+            return COMPRESSION_DEFLATE
+        return COMPRESSION_NONE
+
+    def estimate(self, path):
+        """Return the compressed size ratio of the head of ``path``."""
+        with open(path, 'rb') as fh:
+            sample = fh.read(self.sample_size)
+        if not sample:
+            return 1.0
+        compressor = zlib.compressobj(self.level, zlib.DEFLATED, -15)
+        size = len(compressor.compress(sample)) + len(compressor.flush())
+        return size / float(len(sample))
+
+
+class CRCCache(object):
+    """Interface for caching the CRC-32 of files by their identity.
+
+    :meth:`ZipInfo.from_path` consults the cache (when given one via the
+    ``crc_cache`` attribute), and members store the CRC back once they have
+    read their source. A file's identity is its absolute path, inode, size and
+    modification time, so a changed file simply misses. ``st`` may be an
+    ``os.stat`` result or anything else with its ``st_ino``, ``st_size`` and
+    ``st_mtime_ns`` (or ``st_mtime``).
+
+    """
+
+    def get(self, path, st):
+        """Return the cached CRC of ``path`` with ``os.stat`` result ``st``, or None."""
+        return None
+
+    def set(self, path, st, crc):
+        """Remember the CRC of ``path`` with ``os.stat`` result ``st``."""
+        pass
+
+
+class SQLiteCRCCache(CRCCache):
+    """A :class:`CRCCache` stored in an SQLite database on disk.
+
+    Holds at most ``max_entries`` files, evicting the least recently used.
+
+    """
+
+    def __init__(self, path, max_entries=1000000):
+        import sqlite3
+        self.path = path
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute('PRAGMA synchronous=NORMAL')
+        self._db.execute("""CREATE TABLE IF NOT EXISTS crcs (
+            path TEXT PRIMARY KEY,
+            ino INTEGER NOT NULL,
+            size INTEGER NOT NULL,
+            mtime_ns INTEGER NOT NULL,
+            crc INTEGER NOT NULL,
+            used REAL NOT NULL
+        )""")
+        self._db.execute('CREATE INDEX IF NOT EXISTS crcs_used ON crcs (used)')
+        self._db.commit()
+        self._count = self._db.execute('SELECT count(*) FROM crcs').fetchone()[0]
+
+    def close(self):
+        self._db.close()
+
+    def get(self, path, st):
+        path = os.path.abspath(path)
+        with self._lock:
+            row = self._db.execute(
+                'SELECT ino, size, mtime_ns, crc FROM crcs WHERE path = ?', (path, )
+            ).fetchone()
+            if row is None or tuple(row[:3]) != (st.st_ino, st.st_size, _stat_mtime_ns(st)):
+                return None
+            self._db.execute('UPDATE crcs SET used = ? WHERE path = ?', (time.time(), path))
+            self._db.commit()
+        return row[3]
+
+    def set(self, path, st, crc):
+        path = os.path.abspath(path)
+        row = (st.st_ino, st.st_size, _stat_mtime_ns(st), crc, time.time(), path)
+        with self._lock:
+            cur = self._db.execute(
+                'UPDATE crcs SET ino = ?, size = ?, mtime_ns = ?, crc = ?, used = ? WHERE path = ?',
+                row
+            )
+            if not cur.rowcount:
+                self._db.execute(
+                    'INSERT INTO crcs (ino, size, mtime_ns, crc, used, path) VALUES (?, ?, ?, ?, ?, ?)',
+                    row
+                )
+                self._count += 1
+            if self._count > self.max_entries:
+                self._db.execute(
+                    'DELETE FROM crcs WHERE path IN (SELECT path FROM crcs ORDER BY used LIMIT ?)',
+                    (self._count - self.max_entries, )
+                )
+                self._count = self._db.execute('SELECT count(*) FROM crcs').fetchone()[0]
+            self._db.commit()
+
+
+class _ReadAhead(object):
+    """Reads path sources on worker threads ahead of the consumer.
+
+    While member ``i`` is being consumed, members ``i`` through ``i + depth``
+    are opened and read into bounded queues, which together hold at most
+    about ``max_bytes``.
+
+    """
+
+    def __init__(self, infos, depth, chunk_size, max_bytes):
+        self.infos = infos
+        self.depth = depth
+        self.chunk_size = chunk_size
+        self.maxsize = max(1, max_bytes // (chunk_size * (depth + 1)))
+        self._queues = {}
+        self._next = 0
+        self._stop = threading.Event()
+        self._pool = ThreadPool(depth + 1)
+
+    def close(self):
+        self._stop.set()
+        self._pool.close()
+
+    def iter_source(self, index):
+
+        while self._next < len(self.infos) and self._next <= index + self.depth:
+            info = self.infos[self._next]
+            if info.source_path:
+                queue = Queue.Queue(self.maxsize)
+                self._queues[self._next] = queue
+                self._pool.apply_async(self._read, (info._source_location(), queue))
+            self._next += 1
+
+        queue = self._queues.pop(index)
+        while True:
+            chunk = queue.get()
+            if isinstance(chunk, tuple):
+                raise chunk[0], chunk[1], chunk[2]
+            if not chunk:
+                return
+            yield chunk
+
+    def _read(self, location, queue):
+        path, offset, length = location
+        try:
+            for chunk in _iter_file(path, self.chunk_size, offset, length):
+                if not self._put(queue, chunk):
+                    return
+            self._put(queue, '')
+        except Exception:
+            self._put(queue, sys.exc_info())
+
+    def _put(self, queue, item):
+        while not self._stop.is_set():
+            try:
+                queue.put(item, timeout=0.1)
+            except Queue.Full:
+                continue
+            return True
+        return False
+
+
+class _IOStream(object):
+    """One reader's state in an :class:`IOService`; guarded by its lock."""
+
+    __slots__ = ('path', 'offset', 'remaining', 'chunks', 'ready', 'queued',
+                 'reading', 'eof', 'error', 'cancelled')
+
+    def __init__(self, path, offset, length, lock):
+        self.path = path
+        self.offset = offset
+        self.remaining = length     # None to read to the end of the file
+        self.chunks = collections.deque()
+        self.ready = threading.Condition(lock)
+        self.queued = False         # Waiting in the service's round robin
+        self.reading = False        # A worker is reading for it right now
+        self.eof = False
+        self.error = None
+        self.cancelled = False
+
+
+class _IOHandle(object):
+
+    __slots__ = ('fh', 'lock', 'refs')
+
+    def __init__(self, fh):
+        self.fh = fh
+        self.lock = threading.Lock()    # Held for each seek and read
+        self.refs = 0
+
+
+class IOService(object):
+    """Reads path sources for many concurrent streams, with bounded resources.
+
+    Open files are shared (even across archives) in a pool of at most
+    ``max_handles``, evicting the least recently used idle ones. Reads are
+    done by ``workers`` threads which serve the streams round-robin, one
+    ``chunk_size`` read per stream per turn, and each stream buffers at most
+    ``buffer_chunks`` chunks, so a slow file or a slow consumer holds up no
+    more than its own stream. Install one as :attr:`ZipFile.io_service`.
+
+    """
+
+    def __init__(self, max_handles=256, workers=8, chunk_size=64 * 1024, buffer_chunks=4):
+        self.max_handles = max_handles
+        self.chunk_size = chunk_size
+        self.buffer_chunks = buffer_chunks
+        self._lock = threading.Lock()
+        self._work = threading.Condition(self._lock)
+        self._streams = collections.deque()     # Streams wanting a read, in turn
+        self._active = set()                    # Every stream being iterated
+        self._handles = OrderedDict()           # path -> _IOHandle, oldest first
+        self._closed = False
+        self._threads = []
+        for i in xrange(workers):
+            thread = threading.Thread(target=self._run, name='IOService-%d' % i)
+            thread.daemon = True
+            thread.start()
+            self._threads.append(thread)
+
+    def close(self):
+        with self._lock:
+            self._closed = True
+            self._work.notify_all()
+            for stream in self._active:
+                stream.ready.notify()
+        for thread in self._threads:
+            thread.join()
+        with self._lock:
+            handles = self._handles.values()
+            self._handles.clear()
+        for handle in handles:
+            handle.fh.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def iter_file(self, path, offset=0, length=None):
+        """Yield ``length`` bytes (or all) of the file at ``path`` from ``offset``."""
+
+        stream = _IOStream(path, offset, length, self._lock)
+        with self._lock:
+            self._active.add(stream)
+        try:
+            while True:
+                with self._lock:
+                    self._want(stream)
+                    while not stream.chunks and not stream.eof and stream.error is None:
+                        if self._closed:
+                            raise RuntimeError("IOService is closed.")
+                        stream.ready.wait()
+                    if stream.chunks:
+                        chunk = stream.chunks.popleft()
+                    elif stream.error is not None:
+                        raise stream.error[0], stream.error[1], stream.error[2]
+                    else:
+                        return
+                yield chunk
+        finally:
+            with self._lock:
+                stream.cancelled = True
+                self._active.discard(stream)
+
+    def _want(self, stream):
+        # Called with the lock held: queue the stream for its next read.
+        if (
+            stream.queued or stream.reading or stream.eof or stream.cancelled or
+            stream.error is not None or len(stream.chunks) >= self.buffer_chunks
+        ):
+            return
+        stream.queued = True
+        self._streams.append(stream)
+        self._work.notify()
+
+    def _run(self):
+        while True:
+
+            with self._lock:
+                while not self._streams and not self._closed:
+                    self._work.wait()
+                if self._closed:
+                    return
+                stream = self._streams.popleft()
+                stream.queued = False
+                if stream.cancelled:
+                    continue
+                stream.reading = True
+                size = self.chunk_size
+                if stream.remaining is not None:
+                    size = min(size, stream.remaining)
+
+            chunk = error = None
+            try:
+                chunk = self._read(stream.path, stream.offset, size) if size else ''
+            except Exception:
+                error = sys.exc_info()
+
+            with self._lock:
+                stream.reading = False
+                if error is not None:
+                    stream.error = error
+                elif not chunk:
+                    stream.eof = True
+                else:
+                    stream.chunks.append(chunk)
+                    stream.offset += len(chunk)
+                    if stream.remaining is not None:
+                        stream.remaining -= len(chunk)
+                stream.ready.notify()
+                # To the back of the line, so every stream gets its turn.
+                self._want(stream)
+
+    def _read(self, path, offset, size):
+        handle = self._acquire(path)
+        try:
+            with handle.lock:
+                handle.fh.seek(offset)
+                return handle.fh.read(size)
+        finally:
+            self._release(handle)
+
+    def _acquire(self, path):
+        with self._lock:
+            handle = self._handles.pop(path, None)
+            if handle is not None:
+                handle.refs += 1
+                self._handles[path] = handle
+                return handle
+
+        # Don't hold up everyone else while opening (e.g. over NFS).
+        fh = open(path, 'rb')
+
+        with self._lock:
+            handle = self._handles.pop(path, None)
+            if handle is None:
+                handle = _IOHandle(fh)
+                fh = None
+            handle.refs += 1
+            self._handles[path] = handle
+            idle = self._evict()
+        if fh is not None:
+            fh.close()
+        for x in idle:
+            x.fh.close()
+        return handle
+
+    def _release(self, handle):
+        with self._lock:
+            handle.refs -= 1
+            idle = self._evict()
+        for x in idle:
+            x.fh.close()
+
+    def _evict(self):
+        # Called with the lock held; the caller closes what's returned.
+        idle = []
+        excess = len(self._handles) - self.max_handles
+        if excess > 0:
+            for path, handle in self._handles.items():
+                if handle.refs == 0:
+                    del self._handles[path]
+                    idle.append(handle)
+                    excess -= 1
+                    if not excess:
+                        break
+        return idle
+
+
+class ZipStream(io.RawIOBase):
+    """A read-only file object over the chunks of :meth:`ZipFile.iter`.
+
+    Each ``read(n)`` fills up to ``n`` bytes, so event loops which hand a
+    blocking file to an executor (or to a producer such as Twisted's
+    ``FileSender``) pay one hop per large read instead of one per chunk.
+
+    """
+
+    def __init__(self, chunks):
+        self._chunks = chunks
+        self._chunk = ''
+        self._offset = 0
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        size = len(b)
+        count = 0
+        while count < size:
+            if self._offset >= len(self._chunk):
+                try:
+                    self._chunk = next(self._chunks)
+                except StopIteration:
+                    break
+                self._offset = 0
+                continue
+            n = min(size - count, len(self._chunk) - self._offset)
+            b[count:count + n] = self._chunk[self._offset:self._offset + n]
+            self._offset += n
+            count += n
+        return count
+
+    def close(self):
+        if not self.closed:
+            close = getattr(self._chunks, 'close', None)
+            if close is not None:
+                close()
+        super(ZipStream, self).close()
+
+
+class ArchivePart(object):
+    """One part of an archive's bytes, from :meth:`ZipFile.plan_parts`.
+
+    Parts are generated with :meth:`ZipFile.iter_range`, so each can be
+    produced (say, uploaded) on its own thread, in any order.
+
+    """
+
+    __slots__ = ('zipfile', 'number', 'start', 'end')
+
+    def __init__(self, zipfile, number, start, end):
+        self.zipfile = zipfile
+        self.number = number    # Counting from 1, as multipart uploads do
+        self.start = start
+        self.end = end
+
+    def __len__(self):
+        return self.end - self.start
+
+    def __repr__(self):
+        return '<ArchivePart %d [%d, %d)>' % (self.number, self.start, self.end)
+
+    def iter(self):
+        return self.zipfile.iter_range(self.start, self.end)
+
+    def read(self):
+        return ''.join(self.iter())
+
+    def open(self):
+        """Return a :class:`ZipStream` file object reading :meth:`iter`."""
+        return ZipStream(self.iter())
+
+
+class DeflateCache(object):
+    """Deflated member data, held in memory and spilled to disk.
+
+    The least recently used entries beyond ``max_memory`` bytes are written
+    to files in ``spill_dir`` (a new temporary directory by default), and
+    those beyond ``max_disk`` bytes are dropped. Members sourced from the
+    cache compress their source again if their entry was dropped, but
+    entries still used by members (see :meth:`pin`) are never dropped, even
+    beyond ``max_disk``.
+
+    """
+
+    def __init__(self, max_memory=64 * 1024 * 1024, max_disk=4 * 1024 * 1024 * 1024, spill_dir=None):
+        self.max_memory = max_memory
+        self.max_disk = max_disk
+        self._own_dir = spill_dir is None
+        self.spill_dir = tempfile.mkdtemp(prefix='zipseer-') if spill_dir is None else spill_dir
+        self._lock = threading.Lock()
+        self._memory = OrderedDict()    # key -> (data, crc, file_size)
+        self._memory_size = 0
+        self._disk = OrderedDict()      # key -> (path, compress_size, crc, file_size)
+        self._disk_size = 0
+        self._counter = 0
+        self._pins = {}                 # key -> number of users
+
+    def close(self):
+        with self._lock:
+            self._memory.clear()
+            self._disk.clear()
+            self._memory_size = self._disk_size = 0
+            if self._own_dir:
+                shutil.rmtree(self.spill_dir, ignore_errors=True)
+
+    def get(self, key):
+        """Return ``(compress_size, crc, file_size)`` for ``key``, or None."""
+        with self._lock:
+            entry = self._memory.pop(key, None)
+            if entry is not None:
+                self._memory[key] = entry
+                return len(entry[0]), entry[1], entry[2]
+            entry = self._disk.pop(key, None)
+            if entry is not None:
+                self._disk[key] = entry
+                return entry[1:]
+
+    def open(self, key):
+        """Return a file object reading the deflated data for ``key``, or None."""
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                return StringIO(entry[0])
+            entry = self._disk.get(key)
+            if entry is not None:
+                return open(entry[0], 'rb')
+
+    def pin(self, key):
+        """Keep the entry for ``key`` (once it's put) until :meth:`unpin`."""
+        with self._lock:
+            self._pins[key] = self._pins.get(key, 0) + 1
+
+    def unpin(self, key):
+        with self._lock:
+            count = self._pins.pop(key, 0) - 1
+            if count > 0:
+                self._pins[key] = count
+                return
+            # Pinned entries may have been let over the limits; enforce them again.
+            while self._memory_size > self.max_memory and self._memory:
+                self._spill(*self._memory.popitem(last=False))
+            self._make_room(0)
+
+    def new_path(self):
+        """Return a new file name in ``spill_dir``, for :meth:`put_file`."""
+        with self._lock:
+            return self._new_path()
+
+    def _new_path(self):
+        if not os.path.isdir(self.spill_dir):
+            os.makedirs(self.spill_dir) # Again, after close().
+        self._counter += 1
+        return os.path.join(self.spill_dir, '%d.deflate' % self._counter)
+
+    def put_file(self, key, path, crc, file_size):
+        """Take over deflated data already written to ``path`` (from :meth:`new_path`)."""
+        size = os.path.getsize(path)
+        with self._lock:
+            old = self._memory.pop(key, None)
+            if old is not None:
+                self._memory_size -= len(old[0])
+            old = self._disk.pop(key, None)
+            if old is not None:
+                self._remove(old)
+            self._make_room(size)
+            if self._disk_size + size > self.max_disk and not self._pins.get(key):
+                os.unlink(path)
+                return
+            self._disk[key] = (path, size, crc, file_size)
+            self._disk_size += size
+
+    def discard(self, key):
+        with self._lock:
+            entry = self._memory.pop(key, None)
+            if entry is not None:
+                self._memory_size -= len(entry[0])
+            entry = self._disk.pop(key, None)
+            if entry is not None:
+                self._remove(entry)
+
+    def put(self, key, data, crc, file_size):
+        with self._lock:
+            old = self._memory.pop(key, None)
+            if old is not None:
+                self._memory_size -= len(old[0])
+            self._memory[key] = (data, crc, file_size)
+            self._memory_size += len(data)
+            while self._memory_size > self.max_memory and self._memory:
+                self._spill(*self._memory.popitem(last=False))
+
+    def _spill(self, key, entry):
+        data, crc, file_size = entry
+        self._memory_size -= len(data)
+        old = self._disk.pop(key, None)
+        if old is not None:
+            self._remove(old)
+        pinned = self._pins.get(key)
+        if len(data) > self.max_disk and not pinned:
+            return
+        self._make_room(len(data))
+        if self._disk_size + len(data) > self.max_disk and not pinned:
+            return
+        path = self._new_path()
+        with open(path, 'wb') as fh:
+            fh.write(data)
+        self._disk[key] = (path, len(data), crc, file_size)
+        self._disk_size += len(data)
+
+    def _make_room(self, size):
+        # Drop the least recently used unpinned files until ``size`` fits.
+        for key in list(self._disk):
+            if self._disk_size + size <= self.max_disk:
+                return
+            if not self._pins.get(key):
+                self._remove(self._disk.pop(key))
+
+    def _remove(self, entry):
+        self._disk_size -= entry[1]
+        try:
+            os.unlink(entry[0])
+        except OSError:
+            pass
+
+
+def _deflate_large(cache, key, path, level=-1, workers=None, block_size=1024 * 1024):
+    """Deflate the file at ``path`` in parallel blocks, straight into ``cache``.
+
+    The data goes to a file in the cache's spill directory as each block is
+    done, so it's never all in memory. Returns ``(compress_size, crc,
+    file_size)``.
+
+    """
+    spill = cache.new_path()
+    try:
+        with open(spill, 'wb') as out:
+            result = _deflate_parallel(_iter_file(path, block_size), out, level, workers)
+    except:
+        if os.path.exists(spill):
+            os.unlink(spill)
+        raise
+    cache.put_file(key, spill, result[1], result[2])
+    return result
+
+
+class _DeflatedSource(object):
+    """A ``source_func`` which reads a member's data from a :class:`DeflateCache`.
+
+    Its entry is pinned in the cache for as long as this exists.
+
+    """
+
+    def __init__(self, cache, key, source, level, crc, block_size=None):
+        self.cache = cache
+        self.key = key
+        self.source = source    # The original path or function.
+        self.level = level
+        self.crc = crc
+        self.block_size = block_size    # If compressed with _deflate_parallel
+        cache.pin(key)
+
+    def __del__(self):
+        self.cache.unpin(self.key)
+
+    def __call__(self):
+        fh = self.cache.open(self.key)
+        if fh is None and self.block_size is not None:
+            _, crc, _ = _deflate_large(self.cache, self.key, self.source, self.level,
+                                       block_size=self.block_size)
+            if crc != self.crc:
+                self.cache.discard(self.key)
+                raise ValueError("Source changed since it was compressed.", self.source)
+            fh = self.cache.open(self.key)
+        if fh is None:
+            if callable(self.source):
+                data, crc, file_size = _deflate(_iter_func(self.source), self.level)
+            else:
+                data, crc, file_size = _deflate_path((self.source, self.level))
+            if crc != self.crc:
+                raise ValueError("Source changed since it was compressed.", self.source)
+            self.cache.put(self.key, data, crc, file_size)
+            fh = StringIO(data)
+        return self._iter(fh)
+
+    def _iter(self, fh):
+        try:
+            while True:
+                chunk = fh.read(1024 * 1024)
+                if not chunk:
+                    return
+                yield chunk
+        finally:
+            fh.close()
+
+
+def _iter_func(func):
+    x = func()
+    if isinstance(x, basestring):
+        yield x
+        return
+    for chunk in x:
+        yield chunk
+
+
+class MemberStats(object):
+    """What one member cost while streaming; passed to :meth:`IterHooks.member_end`."""
+
+    __slots__ = ('bytes', 'source_time', 'crc_time', 'consumer_time', 'total_time', 'complete')
+
+    def __init__(self):
+        self.bytes = 0              # Bytes yielded for the member's record
+        self.source_time = 0.0      # Time waiting on the source (path or function)
+        self.crc_time = 0.0         # Time computing the CRC
+        self.consumer_time = 0.0    # Time the consumer held the generator
+        self.total_time = 0.0       # Wall time from start to end of the member
+        self.complete = False       # False if the source failed or the generator was abandoned
+
+
+class IterHooks(object):
+    """Callbacks for observing :meth:`ZipFile.iter`; override what you need.
+
+    Install one as :attr:`ZipFile.hooks`. Without one, :meth:`ZipFile.iter`
+    does no timing at all.
+
+    """
+
+    def member_start(self, info):
+        pass
+
+    def member_end(self, info, stats):
+        """Called with a :class:`MemberStats` once the member is done.
+
+        Also called, with partial stats and ``stats.complete`` false, if the
+        member's source raises or the generator is closed part way through.
+
+        """
+        pass
+
+    def archive_end(self, zipfile):
+        """Called after the central directory; ``zipfile._pos`` is the total size."""
+        pass
+
+
+class StatsHooks(IterHooks):
+    """:class:`IterHooks` which keeps aggregate counters, e.g. to be scraped.
+
+    One instance may be shared by many concurrent archives.
+
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counters = dict(
+            archives=0,
+            members=0,
+            bytes=0,
+            source_time=0.0,
+            crc_time=0.0,
+            consumer_time=0.0,
+            member_time=0.0,
+            active_members=0,
+            incomplete_members=0,
+        )
+
+    def snapshot(self):
+        """Return a copy of the counters."""
+        with self._lock:
+            return dict(self.counters)
+
+    def member_start(self, info):
+        with self._lock:
+            self.counters['active_members'] += 1
+
+    def member_end(self, info, stats):
+        with self._lock:
+            c = self.counters
+            c['active_members'] -= 1
+            c['members' if stats.complete else 'incomplete_members'] += 1
+            c['bytes'] += stats.bytes
+            c['source_time'] += stats.source_time
+            c['crc_time'] += stats.crc_time
+            c['consumer_time'] += stats.consumer_time
+            c['member_time'] += stats.total_time
+
+    def archive_end(self, zipfile):
+        with self._lock:
+            self.counters['archives'] += 1
+
+
+def _iter_timed(chunks, stats):
+    """Yield from ``chunks``, adding the time spent producing them to ``stats.source_time``."""
+    clock = time.time
+    chunks = iter(chunks)
+    while True:
+        start = clock()
+        try:
+            chunk = next(chunks)
+        except StopIteration:
+            stats.source_time += clock() - start
+            return
+        stats.source_time += clock() - start
+        yield chunk
+
+
 class ZipInfo(object):
     """Class with attributes describing each file in the ZIP archive."""
 
@@ -91,6 +1208,13 @@ class ZipInfo(object):
             'use_zip64',
             'source_path',
             'source_func',
+            'source_stat',
+            'crc_cache',
+            'reuse_path',
+            'reuse_offset',
+            'source_offset',
+            '_filename_cache',
+            '_date_cache',
         )
 
     def __init__(self, filename, date_time=(1980, 1, 1, 0, 0, 0), **kwargs):
@@ -132,6 +1256,20 @@ class ZipInfo(object):
         # For deferred creation.
         self.source_path = None
         self.source_func = None
+        self.source_stat = None         # Identity of source_path (a _SourceStat), if known
+        self.source_offset = None       # Where the data starts in source_path,
+                                        # if it's only compress_size bytes of it
+        self.crc_cache = None           # CRCCache to consult and update
+
+        # Where to copy a path source's data from instead, e.g. a previous
+        # build of the same archive; see ZipFile.reuse_from.
+        self.reuse_path = None
+        self.reuse_offset = None
+
+        # Encodings of filename and date_time, for as long as they are the
+        # same objects.
+        self._filename_cache = None
+        self._date_cache = None
 
         # Mutable state, mostly set by ZipFile
         self.use_zip64 = False             # Are we using zip64 for sure?
@@ -144,9 +1282,10 @@ class ZipInfo(object):
             setattr(self, k, v)
 
     @classmethod
-    def from_path(cls, filename, arcname=None, **kwargs):
+    def from_path(cls, filename, arcname=None, st=None, **kwargs):
 
-        st = os.stat(filename)
+        if st is None:
+            st = os.stat(filename)
         isdir = stat.S_ISDIR(st.st_mode)
         mtime = time.localtime(st.st_mtime)
         date_time = mtime[0:6]
@@ -164,6 +1303,12 @@ class ZipInfo(object):
         self.external_attr = (st[0] & 0xFFFF) << 16 # Unix attributes
         self.compress_size = st.st_size
         self.source_path = filename
+        # Only what identifies the file; a whole stat result costs more than
+        # the rest of the member.
+        self.source_stat = _SourceStat(st.st_ino, st.st_size, _stat_mtime_ns(st))
+
+        if self.crc_cache is not None and self.crc is None and not isdir:
+            self.crc = self.crc_cache.get(filename, st)
 
         if isdir:
             self.compress_type = COMPRESSION_NONE
@@ -228,7 +1373,7 @@ class ZipInfo(object):
     def finalize(self):
         if self.file_size is None:
             if self.compress_type != COMPRESSION_NONE:
-                raise ValueError("file_size required if content is compressed.")
+                raise ValueError("file_size required if content is compressed; see ZipFile.precompress().")
             self.file_size = self.compress_size
         if self.needs_zip64:
             self.use_zip64 = True
@@ -238,9 +1383,7 @@ class ZipInfo(object):
     def dumps_local_file_header(self):
 
         """Return the per-file header as a string."""
-        dt = self.date_time
-        dosdate = (dt[0] - 1980) << 9 | dt[1] << 5 | dt[2]
-        dostime = dt[3] << 11 | dt[4] << 5 | (dt[5] // 2)
+        dosdate, dostime = self._encode_date_time()
 
         if self.use_data_descriptor:
             # We write these again after the file.
@@ -259,15 +1402,14 @@ class ZipInfo(object):
             # if the ZIP64 "extra" exists, and (c) if we don't do either then
             # how will the decompressor know that data descriptor will have
             # 8 byte values?
-            fmt = '<HHQQ'
-            extra = extra + struct.pack(fmt, 1, struct.calcsize(fmt) - 4, file_size, compress_size)
+            extra = extra + _Zip64Extras[2].pack(1, 16, file_size, compress_size)
             file_size = 0xffffffff
             compress_size = 0xffffffff
             self.extract_version = max(45, self.extract_version)
             self.create_version = max(45, self.extract_version)
 
         filename, flag_bits = self._encode_filename_flags()
-        header = struct.pack(structFileHeader, stringFileHeader,
+        header = _FileHeader.pack(stringFileHeader,
                  self.extract_version, self.reserved, flag_bits,
                  self.compress_type, dostime, dosdate, CRC,
                  compress_size, file_size,
@@ -275,36 +1417,127 @@ class ZipInfo(object):
 
         return header + filename + extra
 
+    def local_file_header_size(self):
+        """Length of :meth:`dumps_local_file_header`, without packing it."""
+        size = sizeFileHeader + len(self._encode_filename_flags()[0]) + len(self.extra)
+        if self.use_zip64:
+            size += sizeZip64Extra
+        return size
+
+    def data_descriptor_size(self):
+        """Length of :meth:`dumps_data_descriptor`, without packing it."""
+        if not self.use_data_descriptor:
+            return 0
+        return sizeDataDescriptor64 if self.use_zip64 else sizeDataDescriptor
+
+    def central_directory_header_size(self):
+        """Length of :meth:`dumps_central_directory_header`, without packing it."""
+        size = (sizeCentralDir + len(self._encode_filename_flags()[0]) +
+                len(self.extra) + len(self.comment))
+        count = 2 if self.needs_zip64 else 0
+        if self.header_offset > MAX_32BIT:
+            count += 1
+        if count:
+            size += 4 + 8 * count
+        return size
+
     def dumps_data_descriptor(self):
         if self.use_data_descriptor:
-            fmt = structDataDescriptor64 if self.use_zip64 else structDataDescriptor
+            fmt = _DataDescriptor64 if self.use_zip64 else _DataDescriptor
             CRC = self.crc or 0 # Only allowed during size calc.
-            return struct.pack(fmt,
+            return fmt.pack(
                 stringDataDescriptor, CRC, self.compress_size, self.file_size
             )
         return ''
 
     def _encode_filename_flags(self):
-        if isinstance(self.filename, unicode):
-            try:
-                return self.filename.encode('ascii'), self.flag_bits
-            except UnicodeEncodeError:
-                return self.filename.encode('utf-8'), self.flag_bits | 0x800
-        else:
-            return self.filename, self.flag_bits
-
-    def iter_main(self):
+        cache = self._filename_cache
+        if cache is None or cache[0] is not self.filename:
+            filename = self.filename
+            if isinstance(filename, unicode):
+                try:
+                    cache = (filename, filename.encode('ascii'), 0)
+                except UnicodeEncodeError:
+                    cache = (filename, filename.encode('utf-8'), 0x800)
+            else:
+                cache = (filename, filename, 0)
+            self._filename_cache = cache
+        return cache[1], self.flag_bits | cache[2]
+
+    def _encode_date_time(self):
+        cache = self._date_cache
+        if cache is None or cache[0] is not self.date_time:
+            dt = self.date_time
+            dosdate = (dt[0] - 1980) << 9 | dt[1] << 5 | dt[2]
+            dostime = dt[3] << 11 | dt[4] << 5 | (dt[5] // 2)
+            cache = self._date_cache = (dt, dosdate, dostime)
+        return cache[1], cache[2]
+
+    def iter_main(self, chunk_size=8192, source=None, stats=None):
         yield self.dumps_local_file_header()
-        for chunk in self._iter_source():
+        for chunk in self._iter_source(chunk_size, source, stats):
             yield chunk
         yield self.dumps_data_descriptor()
 
-    def _iter_source(self):
+    def iter_range(self, start, end, chunk_size=8192, io_service=None):
+        """Yield bytes ``[start, end)`` of this member's local record.
+
+        Offsets are relative to :attr:`header_offset`; the record is the local
+        header, the data, and the data descriptor (if any). A path source is
+        read through ``io_service`` (an :class:`IOService`), if given.
+        """
+
+        header = self.dumps_local_file_header()
+        data_start = len(header)
+        data_end = data_start + self.compress_size
+
+        if start < data_start and end > 0:
+            yield header[max(start, 0):end]
 
+        if start < data_end and end > data_start:
+            offset = max(start, data_start) - data_start
+            length = min(end, data_end) - data_start - offset
+            for chunk in self._iter_source_range(offset, length, chunk_size, io_service):
+                yield chunk
+
+        if end > data_end and self.use_data_descriptor:
+            if self.crc is None:
+                self.compute_crc()
+            descriptor = self.dumps_data_descriptor()
+            if start < data_end + len(descriptor):
+                yield descriptor[max(start - data_end, 0):end - data_end]
+
+    def compute_crc(self, chunk_size=1024 * 1024):
+        """Read the whole source to determine (and set) the CRC."""
+        CRC = 0
+        size = 0
+        for chunk in self._iter_raw_source(chunk_size):
+            size += len(chunk)
+            CRC = crc32(chunk, CRC) & 0xffffffff
+        self._learn_crc(CRC, size)
+        return CRC
+
+    def _learn_crc(self, crc, size):
+        self.crc = crc
+        if (
+            self.crc_cache is not None and
+            self.source_path and
+            self.source_stat is not None and
+            size == self.source_stat.st_size
+        ):
+            self.crc_cache.set(self.source_path, self.source_stat, crc)
+
+    def _iter_raw_source(self, chunk_size=8192):
         if self.source_path:
-            iter_ = self._iter_source_path()
+            return self._iter_source_path(chunk_size)
+        elif self.source_func:
+            return self._iter_source_func()
         else:
-            iter_ = self._iter_source_func()
+            return iter(()) # Empty, e.g. a directory.
+
+    def _iter_source(self, chunk_size=8192, source=None, stats=None):
+
+        iter_ = self._iter_raw_source(chunk_size) if source is None else source
 
         if self.crc is not None:
             for chunk in iter_:
@@ -313,93 +1546,901 @@ class ZipInfo(object):
 
         CRC = 0
         size = 0
-        for chunk in iter_:
-            size += len(chunk)
-            CRC = crc32(chunk, CRC) & 0xffffffff
-            yield chunk
+        if stats is None:
+            for chunk in iter_:
+                size += len(chunk)
+                CRC = crc32(chunk, CRC) & 0xffffffff
+                yield chunk
+        else:
+            clock = time.time
+            for chunk in iter_:
+                size += len(chunk)
+                start = clock()
+                CRC = crc32(chunk, CRC) & 0xffffffff
+                stats.crc_time += clock() - start
+                yield chunk
 
         # TODO: Warn if the size (or CRC) differs.
 
-        self.crc = CRC
-
-    def _iter_source_path(self):
-        with open(self.source_path, 'rb') as fh:
-            while True:
-                chunk = fh.read(8192)
-                if not chunk:
-                    return
+        self._learn_crc(CRC, size)
+
+    def _source_location(self):
+        """Return ``(path, offset, length)`` to read a path source from.
+
+        ``length`` is None to read to the end of the file.
+
+        """
+        if self.reuse_path is not None:
+            return self.reuse_path, self.reuse_offset, self.compress_size
+        if self.source_offset is not None:
+            return self.source_path, self.source_offset, self.compress_size
+        return self.source_path, 0, None
+
+    def _iter_source_path(self, chunk_size=8192):
+        path, offset, length = self._source_location()
+        return _iter_file(path, chunk_size, offset, length)
+
+    def copy_source_to(self, fd):
+        """Copy a path source's contents straight to ``fd``.
+
+        Uses ``os.sendfile`` where available, otherwise a single reused
+        buffer, so the bytes never become Python strings. Returns the number
+        of bytes copied.
+
+        """
+        path, offset, _ = self._source_location()
+        length = self.compress_size
+        copied = 0
+        with io.open(path, 'rb', buffering=0) as fh:
+            if sendfile is not None:
+                while copied < length:
+                    sent = sendfile(fd, fh.fileno(), offset + copied, length - copied)
+                    if not sent:
+                        break
+                    copied += sent
+                return copied
+            fh.seek(offset)
+            buf = memoryview(bytearray(1024 * 1024))
+            while copied < length:
+                count = fh.readinto(buf[:min(len(buf), length - copied)])
+                if not count:
+                    break
+                _write_all(fd, buf[:count])
+                copied += count
+        return copied
+
+    def _iter_source_range(self, offset, length, chunk_size=8192, io_service=None):
+        if not length or not (self.source_path or self.source_func):
+            return # Nothing to read, e.g. a directory.
+        if self.source_path:
+            path, base, _ = self._source_location()
+            if io_service is not None:
+                chunks = io_service.iter_file(path, base + offset, length)
+            else:
+                chunks = _iter_file(path, chunk_size, base + offset, length)
+            for chunk in chunks:
+                yield chunk
+        else:
+            # We can't seek in a function's output, so generate and skip.
+            for chunk in _iter_slice(self._iter_source_func(), offset, offset + length):
                 yield chunk
 
     def _iter_source_func(self):
-        x = self.source_func()
-        if isinstance(x, basestring):
-            yield x
-            return
-        for chunk in x:
-            yield chunk
+        return _iter_func(self.source_func)
 
     def dumps_central_directory_header(self):
 
-        dt = self.date_time
-        dosdate = (dt[0] - 1980) << 9 | dt[1] << 5 | dt[2]
-        dostime = dt[3] << 11 | dt[4] << 5 | (dt[5] // 2)
-        extra = []
+        dosdate, dostime = self._encode_date_time()
+        file_size = self.file_size
+        compress_size = self.compress_size
+        header_offset = self.header_offset
+        create_version = self.create_version
+        extract_version = self.extract_version
+        extra = self.extra
 
         # TODO: Should this be use_zip64??
-        if self.needs_zip64:
-            extra.append(self.file_size)
-            extra.append(self.compress_size)
-            file_size = 0xffffffff
-            compress_size = 0xffffffff
-        else:
-            file_size = self.file_size
-            compress_size = self.compress_size
-
-        header_offset = self.header_offset
-        if header_offset > MAX_32BIT:
-            extra.append(header_offset)
-            header_offset = 0xffffffff
-
-        extra_data = self.extra
-        if extra:
-            # Append a ZIP64 field to the extra's
-            extra_data = struct.pack(
-                    '<HH' + 'Q'*len(extra),
-                    1, 8*len(extra), *extra) + extra_data
-
-            extract_version = max(45, self.extract_version)
-            create_version = max(45, self.create_version)
-        else:
-            extract_version = self.extract_version
-            create_version = self.create_version
+        needs_zip64 = file_size > MAX_32BIT or compress_size > MAX_32BIT
+        if needs_zip64 or header_offset > MAX_32BIT:
+            zip64 = []
+            if needs_zip64:
+                zip64.append(file_size)
+                zip64.append(compress_size)
+                file_size = 0xffffffff
+                compress_size = 0xffffffff
+            if header_offset > MAX_32BIT:
+                zip64.append(header_offset)
+                header_offset = 0xffffffff
+            # A ZIP64 field goes before the other extras.
+            extra = _Zip64Extras[len(zip64)].pack(1, 8 * len(zip64), *zip64) + extra
+            extract_version = max(45, extract_version)
+            create_version = max(45, create_version)
 
         filename, flag_bits = self._encode_filename_flags()
+        comment = self.comment
 
         CRC = self.crc or 0 # We're only allowed to do this during size calc.
 
-        centdir = struct.pack(structCentralDir,
+        return _CentralDir.pack(
             stringCentralDir, create_version,
             self.create_system, extract_version, self.reserved,
             flag_bits, self.compress_type, dostime, dosdate,
             CRC, compress_size, file_size,
-            len(filename), len(extra_data), len(self.comment),
+            len(filename), len(extra), len(comment),
             0, self.internal_attr, self.external_attr,
             header_offset
+        ) + filename + extra + comment
+
+    def pack_central_directory_header_into(self, buf, offset):
+        """Pack the central directory record into ``buf`` at ``offset``.
+
+        ``buf`` must have :meth:`central_directory_header_size` bytes free
+        there. Returns the offset just after the record.
+
+        """
+        record = self.dumps_central_directory_header()
+        end = offset + len(record)
+        buf[offset:end] = record
+        return end
+
+
+# Bits in MemberTable's per-member flags column.
+_MEMBER_ZIP64 = 0x01
+_MEMBER_NO_HEADER_OFFSET = 0x02
+_MEMBER_NO_CRC = 0x04
+_MEMBER_NO_COMPRESS_SIZE = 0x08
+_MEMBER_NO_FILE_SIZE = 0x10
+_MEMBER_UNICODE = 0x20
+_MEMBER_SOURCE_PATH = 0x40
+_MEMBER_SOURCE_STAT = 0x80
+
+
+class _SourceStat(object):
+    """The parts of ``os.stat`` which identify a source (see :class:`CRCCache`)."""
+
+    __slots__ = ('st_ino', 'st_size', 'st_mtime_ns')
+
+    def __init__(self, st_ino, st_size, st_mtime_ns):
+        self.st_ino = st_ino
+        self.st_size = st_size
+        self.st_mtime_ns = st_mtime_ns
+
+
+def _dos_to_date_time(dosdate, dostime):
+    return ((dosdate >> 9) + 1980, (dosdate >> 5) & 0xf, dosdate & 0x1f,
+            dostime >> 11, (dostime >> 5) & 0x3f, (dostime & 0x1f) * 2)
+
+
+class _MemberView(ZipInfo):
+    """A :class:`ZipInfo` whose attributes live in a :class:`MemberTable`
+    (or :class:`ManifestTable`)."""
+
+    __slots__ = ('_table', '_index')
+
+    def __init__(self, table, index):
+        self._table = table
+        self._index = index
+
+    def _encode_filename_flags(self):
+        return self._table._encode_filename_flags(self._index)
+
+    def _encode_date_time(self):
+        return self._table._encode_date_time(self._index)
+
+
+# The attributes a table stores for each member.
+_MEMBER_ATTRS = tuple(name for name in ZipInfo.__slots__ if not name.startswith('_'))
+
+
+def _member_view_property(name):
+    def fget(self):
+        return self._table.get(self._index, name)
+    def fset(self, value):
+        self._table.set(self._index, name, value)
+    return property(fget, fset)
+
+for _name in _MEMBER_ATTRS:
+    setattr(_MemberView, _name, _member_view_property(_name))
+del _name
+
+
+def _member_view_class(getters, setters):
+    """Return a :class:`_MemberView` subclass whose attributes call
+    ``getters[name](index)`` and ``setters[name](index, value)`` directly,
+    skipping the table's :meth:`get` and :meth:`set`."""
+    def view_property(get, set):
+        return property(lambda self: get(self._index), lambda self, value: set(self._index, value))
+    attrs = dict((name, view_property(getters[name], setters[name])) for name in _MEMBER_ATTRS)
+    attrs['__slots__'] = ()
+    return type('_MemberView', (_MemberView,), attrs)
+
+
+class _Blob(object):
+    """Many strings packed end to end into one ``bytearray``."""
+
+    def __init__(self):
+        self.data = bytearray()
+        self.starts = _uint64_array()
+        self.ends = _uint64_array()
+
+    def __len__(self):
+        return len(self.ends)
+
+    def append(self, value):
+        self.starts.append(len(self.data))
+        self.data.extend(value)
+        self.ends.append(len(self.data))
+
+    def get(self, i):
+        return str(self.data[self.starts[i]:self.ends[i]])
+
+    def set(self, i, value):
+        start = self.starts[i]
+        if len(value) == self.ends[i] - start:
+            self.data[start:self.ends[i]] = value
+        else:
+            # The old value is simply abandoned.
+            self.starts[i] = len(self.data)
+            self.data.extend(value)
+            self.ends[i] = len(self.data)
+
+
+class MemberTable(object):
+    """A compact, column-oriented store of archive members.
+
+    Pass ``compact=True`` to :class:`ZipFile` to use one in place of the list
+    of :class:`ZipInfo` (and the dict of names). Numeric attributes are kept
+    in parallel arrays, filenames and source paths in packed blobs, names are
+    found through an open-addressing hash table of indices, source functions
+    in a list, and the rarely used attributes (comments, extras, etc.) only
+    take space when they differ from their defaults. This costs on the order of 100 bytes
+    per member plus its names, instead of well over a kilobyte.
+
+    Indexing returns a :class:`ZipInfo` view on demand; setting attributes on
+    it writes through to the table.
+
+    """
+
+    _int_columns = (
+        # (name, typecode, bit set when the value is None); 'Q' columns are
+        # made with _uint64_array.
+        ('compress_type', 'H', 0),
+        ('flag_bits', 'H', 0),
+        ('create_version', 'B', 0),
+        ('extract_version', 'B', 0),
+        ('external_attr', 'I', 0),
+        ('dosdate', 'H', 0),
+        ('dostime', 'H', 0),
+        ('header_offset', 'Q', _MEMBER_NO_HEADER_OFFSET),
+        ('crc', 'I', _MEMBER_NO_CRC),
+        ('compress_size', 'Q', _MEMBER_NO_COMPRESS_SIZE),
+        ('file_size', 'Q', _MEMBER_NO_FILE_SIZE),
+        ('source_ino', 'Q', 0),
+        ('source_size', 'Q', 0),
+        ('source_mtime_ns', 'Q', 0),
+    )
+
+    _sparse_defaults = {
+        'comment': '',
+        'extra': '',
+        'create_system': 0 if sys.platform == 'win32' else 3,
+        'reserved': 0,
+        'volume': 0,
+        'internal_attr': 0,
+        'crc_cache': None,
+        'reuse_path': None,
+        'reuse_offset': None,
+        'source_offset': None,
+    }
+
+    def __init__(self):
+        self._columns = dict(
+            (name, _uint64_array() if code == 'Q' else array(code))
+            for name, code, _ in self._int_columns
         )
-        
-        return centdir + filename + extra_data + self.comment
+        self._bits = array('B')
+        self._names = _Blob()
+        self._paths = _Blob()
+        self._funcs = []
+        self._sparse = {}               # index -> {name: non-default value}
+        self._slots = array('l', [0] * 8) # index + 1, or 0 if empty
+
+        # Every attribute gets its own getter and setter, which this table's
+        # view class calls directly.
+        self._getters = {}
+        self._setters = {}
+        for name in _MEMBER_ATTRS:
+            self._add_other_accessors(name)
+        for name, _, bit in self._int_columns:
+            self._add_column_accessors(name, self._columns[name], bit)
+        for name, default in self._sparse_defaults.iteritems():
+            self._add_sparse_accessors(name, default)
+        self._getters['source_func'] = self._funcs.__getitem__
+        self._setters['source_func'] = self._funcs.__setitem__
+        self._view = _member_view_class(self._getters, self._setters)
+
+    def __len__(self):
+        return len(self._bits)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self._view(self, j) for j in xrange(*i.indices(len(self)))]
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError(i)
+        return self._view(self, i)
+
+    def __iter__(self):
+        for i in xrange(len(self)):
+            yield self._view(self, i)
+
+    def __contains__(self, name):
+        return self._find(name) >= 0
+
+    def index(self, info):
+        i = self._find(info.filename)
+        if i < 0:
+            raise ValueError("Not in table.", info.filename)
+        return i
+
+    def lookup(self, name, default=None):
+        """Return the member called ``name``, or ``default``."""
+        i = self._find(name)
+        return default if i < 0 else self._view(self, i)
+
+    def append(self, info):
+        """Copy ``info`` into the table, returning a view of the new member."""
+
+        name, flags = info._encode_filename_flags()
+        if self._find(name) >= 0:
+            raise ValueError("Duplicate name.", info.filename)
+
+        i = len(self)
+        self._bits.append(_MEMBER_UNICODE if flags & 0x800 else 0)
+        for column in self._columns.itervalues():
+            column.append(0)
+        self._names.append(name)
+        self._paths.append('')
+        self._funcs.append(None)
+
+        setters = self._setters
+        for attr in _MEMBER_ATTRS:
+            if attr != 'filename':
+                setters[attr](i, getattr(info, attr))
+
+        self._insert(name, i)
+        return self._view(self, i)
+
+    def _encode_filename_flags(self, i):
+        flags = 0x800 if self._bits[i] & _MEMBER_UNICODE else 0
+        return self._names.get(i), self._columns['flag_bits'][i] | flags
+
+    def _encode_date_time(self, i):
+        return self._columns['dosdate'][i], self._columns['dostime'][i]
+
+    def _add_other_accessors(self, name):
+        self._getters[name] = lambda i: self._get_other(i, name)
+        self._setters[name] = lambda i, value: self._set_other(i, name, value)
+
+    def _add_column_accessors(self, name, column, bit):
+        if not bit:
+            self._getters[name] = column.__getitem__
+            self._setters[name] = column.__setitem__
+            return
+        bits = self._bits
+        def get(i):
+            return None if bits[i] & bit else column[i]
+        def set(i, value):
+            if value is None:
+                bits[i] |= bit
+                column[i] = 0
+            else:
+                bits[i] &= ~bit
+                column[i] = value
+        self._getters[name] = get
+        self._setters[name] = set
+
+    def _add_sparse_accessors(self, name, default):
+        sparse = self._sparse
+        def get(i):
+            values = sparse.get(i)
+            return default if values is None else values.get(name, default)
+        def set(i, value):
+            values = sparse.get(i)
+            if value == default:
+                if values:
+                    values.pop(name, None)
+                    if not values:
+                        del sparse[i]
+            elif values is None:
+                sparse[i] = {name: value}
+            else:
+                values[name] = value
+        self._getters[name] = get
+        self._setters[name] = set
+
+    def get(self, i, name):
+        try:
+            get = self._getters[name]
+        except KeyError:
+            raise AttributeError(name)
+        return get(i)
+
+    def set(self, i, name, value):
+        try:
+            set = self._setters[name]
+        except KeyError:
+            raise AttributeError(name)
+        set(i, value)
+
+    def _get_other(self, i, name):
+        bits = self._bits[i]
+        if name == 'filename':
+            name = self._names.get(i)
+            return name.decode('utf-8') if bits & _MEMBER_UNICODE else name
+        if name == 'date_time':
+            return _dos_to_date_time(*self._encode_date_time(i))
+        if name == 'use_zip64':
+            return bool(bits & _MEMBER_ZIP64)
+        if name == 'source_path':
+            return self._paths.get(i) if bits & _MEMBER_SOURCE_PATH else None
+        if name == 'source_stat':
+            if not bits & _MEMBER_SOURCE_STAT:
+                return None
+            columns = self._columns
+            return _SourceStat(columns['source_ino'][i], columns['source_size'][i], columns['source_mtime_ns'][i])
+
+        raise AttributeError(name)
+
+    def _set_other(self, i, name, value):
+        if name == 'filename':
+            raise TypeError("Members of a MemberTable cannot be renamed.")
+        if name == 'date_time':
+            dt = value
+            self._columns['dosdate'][i] = (dt[0] - 1980) << 9 | dt[1] << 5 | dt[2]
+            self._columns['dostime'][i] = dt[3] << 11 | dt[4] << 5 | (dt[5] // 2)
+            return
+        if name == 'use_zip64':
+            self._set_bit(i, _MEMBER_ZIP64, value)
+            return
+        if name == 'source_path':
+            self._set_bit(i, _MEMBER_SOURCE_PATH, value is not None)
+            if value is not None:
+                if isinstance(value, unicode):
+                    value = value.encode(sys.getfilesystemencoding())
+                self._paths.set(i, value)
+            return
+        if name == 'source_stat':
+            self._set_bit(i, _MEMBER_SOURCE_STAT, value is not None)
+            if value is not None:
+                self._columns['source_ino'][i] = value.st_ino
+                self._columns['source_size'][i] = value.st_size
+                self._columns['source_mtime_ns'][i] = _stat_mtime_ns(value)
+            return
+
+        raise AttributeError(name)
+
+    def _set_bit(self, i, bit, value):
+        if value:
+            self._bits[i] |= bit
+        else:
+            self._bits[i] &= ~bit
+
+    def _find(self, name):
+        if isinstance(name, unicode):
+            name = name.encode('utf-8')
+        slots = self._slots
+        mask = len(slots) - 1
+        j = crc32(name) & mask
+        while True:
+            k = slots[j]
+            if not k:
+                return -1
+            if self._names.get(k - 1) == name:
+                return k - 1
+            j = (j + 1) & mask
+
+    def _insert(self, name, i):
+        slots = self._slots
+        if 2 * (i + 1) > len(slots):
+            slots = self._slots = array('l', [0] * (2 * len(slots)))
+            for k in xrange(i):
+                self._place(self._names.get(k), k)
+        self._place(name, i)
+
+    def _place(self, name, i):
+        slots = self._slots
+        mask = len(slots) - 1
+        j = crc32(name) & mask
+        while slots[j]:
+            j = (j + 1) & mask
+        slots[j] = i + 1
+
+
+class _MemberNames(object):
+    """The ``info_by_name`` mapping of a :class:`MemberTable` or :class:`ManifestTable`."""
+
+    def __init__(self, table):
+        self.table = table
+
+    def __len__(self):
+        return len(self.table)
+
+    def __contains__(self, name):
+        return name in self.table
+
+    def __getitem__(self, name):
+        info = self.table.lookup(name)
+        if info is None:
+            raise KeyError(name)
+        return info
+
+    def get(self, name, default=None):
+        return self.table.lookup(name, default)
+
+
+# The layout of a manifest written by ZipFile.save_manifest(); see ManifestTable.
+structManifestHeader = '<4sHH7Q'
+stringManifestHeader = 'ZSMF'
+_ManifestHeader = struct.Struct(structManifestHeader)
+_MANIFEST_VERSION = 2
+
+# Fields of each member's fixed-size record, largest first to keep them aligned.
+_MANIFEST_FIELDS = (
+    ('header_offset', 'Q'),
+    ('cd_offset', 'Q'),
+    ('compress_size', 'Q'),
+    ('file_size', 'Q'),
+    ('source_ino', 'Q'),
+    ('source_size', 'Q'),
+    ('source_mtime_ns', 'Q'),
+    ('name_offset', 'Q'),
+    ('path_offset', 'Q'),
+    ('extra_offset', 'Q'),
+    ('comment_offset', 'Q'),
+    ('source_offset', 'Q'),
+    ('crc', 'I'),
+    ('external_attr', 'I'),
+    ('name_len', 'I'),
+    ('path_len', 'I'),
+    ('flag_bits', 'H'),
+    ('compress_type', 'H'),
+    ('internal_attr', 'H'),
+    ('dosdate', 'H'),
+    ('dostime', 'H'),
+    ('extra_len', 'H'),
+    ('comment_len', 'H'),
+    ('create_version', 'B'),
+    ('extract_version', 'B'),
+    ('create_system', 'B'),
+    ('bits', 'B'),
+)
+_ManifestRecord = struct.Struct('<' + ''.join(code for _, code in _MANIFEST_FIELDS) + '6x')
+_manifest_field_structs = {}
+_offset = 0
+for _name, _code in _MANIFEST_FIELDS:
+    _manifest_field_structs[_name] = (struct.Struct('<' + _code), _offset)
+    _offset += struct.calcsize(_code)
+del _name, _code, _offset
+
+_ManifestSlot = struct.Struct('<Q')
+_NO_INDEX = (1 << 64) - 1
+
+
+def _align8(x):
+    return (x + 7) & ~7
+
+
+class ManifestTable(object):
+    """Archive members read lazily from a manifest file.
+
+    A manifest (see :meth:`ZipFile.save_manifest`) is a header, a fixed-size
+    record per member, a blob of names, paths, extras and comments, and an
+    open-addressing hash table of names. It is mapped copy-on-write, so
+    opening it is O(1) regardless of the number of members, and processes
+    which open the same manifest share its pages. Like :class:`MemberTable`,
+    indexing returns :class:`ZipInfo` views.
+
+    """
+
+    def __init__(self, path):
+        import mmap
+        self.path = path
+        with open(path, 'rb') as fh:
+            self._mmap = mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_COPY)
+        (
+            magic, version, _,
+            self._count, self.size, self.members_end, self.cd_size,
+            first_non64, self._records, self._slots,
+        ) = _ManifestHeader.unpack_from(self._mmap, 0)
+        if magic != stringManifestHeader or version != _MANIFEST_VERSION:
+            raise ValueError("Not a version %d manifest." % _MANIFEST_VERSION, path)
+        self.first_non64 = None if first_non64 == _NO_INDEX else first_non64
+        comment_len = struct.unpack_from('<H', self._mmap, _ManifestHeader.size)[0]
+        self.comment = self._mmap[_ManifestHeader.size + 2:_ManifestHeader.size + 2 + comment_len]
+        self._slots_offset = self._records + self._count * _ManifestRecord.size
+        self._overrides = {}        # index -> {name: value} for source_func, etc.
+
+    def close(self):
+        self._mmap.close()
+
+    def __len__(self):
+        return self._count
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [_MemberView(self, j) for j in xrange(*i.indices(len(self)))]
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError(i)
+        return _MemberView(self, i)
+
+    def __iter__(self):
+        for i in xrange(len(self)):
+            yield _MemberView(self, i)
+
+    def __contains__(self, name):
+        return self._find(name) >= 0
+
+    def append(self, info):
+        raise TypeError("Archives loaded from manifests cannot be added to.")
+
+    def index(self, info):
+        i = self._find(info.filename)
+        if i < 0:
+            raise ValueError("Not in table.", info.filename)
+        return i
+
+    def lookup(self, name, default=None):
+        """Return the member called ``name``, or ``default``."""
+        i = self._find(name)
+        return default if i < 0 else _MemberView(self, i)
+
+    def column(self, name):
+        """Return a read-only sequence of one field of every record."""
+        return _ManifestColumn(self, name)
+
+    def _field(self, i, name):
+        fmt, offset = _manifest_field_structs[name]
+        return fmt.unpack_from(self._mmap, self._records + i * _ManifestRecord.size + offset)[0]
+
+    def _set_field(self, i, name, value):
+        # Only write if it changed, so the page stays shared with others.
+        if self._field(i, name) != value:
+            fmt, offset = _manifest_field_structs[name]
+            fmt.pack_into(self._mmap, self._records + i * _ManifestRecord.size + offset, value)
+
+    def _string(self, i, name):
+        offset = self._field(i, name + '_offset')
+        return self._mmap[offset:offset + self._field(i, name + '_len')]
+
+    def _encode_filename_flags(self, i):
+        flags = 0x800 if self._field(i, 'bits') & _MEMBER_UNICODE else 0
+        return self._string(i, 'name'), self._field(i, 'flag_bits') | flags
+
+    def _encode_date_time(self, i):
+        return self._field(i, 'dosdate'), self._field(i, 'dostime')
+
+    def get(self, i, name):
+
+        if name in ('header_offset', 'compress_size', 'file_size', 'external_attr',
+                    'internal_attr', 'flag_bits', 'compress_type',
+                    'create_version', 'extract_version', 'create_system'):
+            return self._field(i, name)
+        if name in ('reserved', 'volume'):
+            return 0
+        if name in ('source_func', 'crc_cache', 'reuse_path', 'reuse_offset'):
+            return self._overrides.get(i, {}).get(name)
+
+        bits = self._field(i, 'bits')
+        if name == 'crc':
+            return None if bits & _MEMBER_NO_CRC else self._field(i, 'crc')
+        if name == 'use_zip64':
+            return bool(bits & _MEMBER_ZIP64)
+        if name == 'filename':
+            name = self._string(i, 'name')
+            return name.decode('utf-8') if bits & _MEMBER_UNICODE else name
+        if name == 'date_time':
+            return _dos_to_date_time(*self._encode_date_time(i))
+        if name in ('extra', 'comment'):
+            return self._string(i, name)
+        if name == 'source_path':
+            return self._string(i, 'path') if bits & _MEMBER_SOURCE_PATH else None
+        if name == 'source_offset':
+            offset = self._field(i, 'source_offset')
+            return None if offset == _NO_INDEX else offset
+        if name == 'source_stat':
+            if not bits & _MEMBER_SOURCE_STAT:
+                return None
+            return _SourceStat(self._field(i, 'source_ino'),
+                               self._field(i, 'source_size'),
+                               self._field(i, 'source_mtime_ns'))
+
+        raise AttributeError(name)
+
+    def set(self, i, name, value):
+
+        if name in ('header_offset', 'compress_size', 'file_size', 'external_attr',
+                    'internal_attr', 'flag_bits', 'compress_type',
+                    'create_version', 'extract_version', 'create_system'):
+            self._set_field(i, name, value)
+            return
+        if name in ('source_func', 'crc_cache', 'reuse_path', 'reuse_offset'):
+            self._overrides.setdefault(i, {})[name] = value
+            return
+
+        bits = self._field(i, 'bits')
+        if name == 'crc':
+            if value is None:
+                self._set_field(i, 'bits', bits | _MEMBER_NO_CRC)
+            else:
+                self._set_field(i, 'crc', value)
+                self._set_field(i, 'bits', bits & ~_MEMBER_NO_CRC)
+            return
+        if name == 'use_zip64':
+            self._set_field(i, 'bits', (bits | _MEMBER_ZIP64) if value else (bits & ~_MEMBER_ZIP64))
+            return
+
+        if self.get(i, name) != value:
+            raise TypeError("Cannot change %s of a member loaded from a manifest." % name)
+
+    def _find(self, name):
+        if isinstance(name, unicode):
+            name = name.encode('utf-8')
+        mask = self._slots - 1
+        j = crc32(name) & mask
+        while True:
+            k = _ManifestSlot.unpack_from(self._mmap, self._slots_offset + 8 * j)[0]
+            if not k:
+                return -1
+            if self._string(k - 1, 'name') == name:
+                return k - 1
+            j = (j + 1) & mask
+
+
+class _ManifestColumn(object):
+    """One field of every record of a :class:`ManifestTable`, as a sequence."""
+
+    def __init__(self, table, name):
+        self.table = table
+        self.name = name
+
+    def __len__(self):
+        return len(self.table)
+
+    def __getitem__(self, i):
+        if i < 0:
+            i += len(self.table)
+        if not 0 <= i < len(self.table):
+            raise IndexError(i)
+        return self.table._field(i, self.name)
+
+
+def _write_manifest(path, zipfile):
+
+    infos = zipfile.infos
+    count = len(infos)
+    comment = zipfile.comment
+
+    slots = 8
+    while slots < 2 * count:
+        slots *= 2
+    records = _align8(_ManifestHeader.size + 2 + len(comment))
+    strings_offset = records + count * _ManifestRecord.size + 8 * slots
+
+    hashes = [0] * slots
+    strings = bytearray()
+
+    def add_string(value):
+        offset = strings_offset + len(strings)
+        strings.extend(value)
+        return offset, len(value)
+
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as fh:
+
+        first_non64 = zipfile._first_non64
+        fh.write(_ManifestHeader.pack(
+            stringManifestHeader, _MANIFEST_VERSION, 0,
+            count, zipfile._size, zipfile._members_end, zipfile._cd_size,
+            _NO_INDEX if first_non64 is None else first_non64,
+            records, slots,
+        ))
+        fh.write(struct.pack('<H', len(comment)) + comment)
+        fh.write('\0' * (records - fh.tell()))
+
+        for i, info in enumerate(infos):
+
+            if info.source_func is not None:
+                raise ValueError("Members with source functions cannot be saved.", info)
+
+            name, flags = info._encode_filename_flags()
+            name_offset, name_len = add_string(name)
+            bits = _MEMBER_UNICODE if flags & 0x800 else 0
+
+            path_offset = path_len = 0
+            if info.source_path is not None:
+                bits |= _MEMBER_SOURCE_PATH
+                source_path = info.source_path
+                if isinstance(source_path, unicode):
+                    source_path = source_path.encode(sys.getfilesystemencoding())
+                path_offset, path_len = add_string(source_path)
+
+            st = info.source_stat
+            if st is not None:
+                bits |= _MEMBER_SOURCE_STAT
+                source = (st.st_ino, st.st_size, _stat_mtime_ns(st))
+            else:
+                source = (0, 0, 0)
+
+            extra_offset, extra_len = add_string(info.extra)
+            comment_offset, comment_len = add_string(info.comment)
+
+            if info.use_zip64:
+                bits |= _MEMBER_ZIP64
+            if info.crc is None:
+                bits |= _MEMBER_NO_CRC
+
+            dosdate, dostime = info._encode_date_time()
+            fh.write(_ManifestRecord.pack(
+                info.header_offset, zipfile._cd_offsets[i],
+                info.compress_size, info.file_size,
+                source[0], source[1], source[2],
+                name_offset, path_offset, extra_offset, comment_offset,
+                _NO_INDEX if info.source_offset is None else info.source_offset,
+                info.crc or 0, info.external_attr, name_len, path_len,
+                info.flag_bits, info.compress_type, info.internal_attr,
+                dosdate, dostime, extra_len, comment_len,
+                info.create_version, info.extract_version, info.create_system,
+                bits,
+            ))
+
+            j = crc32(name) & (slots - 1)
+            while hashes[j]:
+                j = (j + 1) & (slots - 1)
+            hashes[j] = i + 1
+
+        fh.write(''.join(itertools.imap(_ManifestSlot.pack, hashes)))
+        fh.write(strings)
+
+    os.rename(tmp_path, path)
 
 
 class ZipFile(object):
 
-    def __init__(self):
+    def __init__(self, crc_cache=None, compact=False):
+        self.crc_cache = crc_cache  # Default CRCCache for add_from_path
+        self._size = None
         self.comment = ''
-        self.infos = []      # List of ZipInfo instances for archive
-        self.info_by_name = {}    # Find file info given name
+        if compact:
+            self.infos = MemberTable()
+            self.info_by_name = _MemberNames(self.infos)
+        else:
+            self.infos = []      # List of ZipInfo instances for archive
+            self.info_by_name = {}    # Find file info given name
+
+        self.deflate_cache = None       # DeflateCache for precompress()
+        self.hooks = None               # IterHooks to observe iter()
+        self.chunk_size = 8192          # Read size for path sources
+        self.readahead = 0              # Members to open and read ahead
+        self.readahead_bytes = 8 * 1024 * 1024 # Memory budget for that
+        self.io_service = None          # IOService to read path sources through
+        self.compression_policy = None  # CompressionPolicy for add_from_path
+        self.parallel_deflate_size = 64 * 1024 * 1024 # Split path members this big
+        self.deflate_block_size = 1024 * 1024 # into blocks of this size
 
         self._finalized = False
         self._pos = 0
 
+        # The layout of infos[:len(self._offsets)] as of the last
+        # calculate_size(); only the suffix after it is laid out again.
+        self._offsets = _uint64_array()     # Header offset of each member
+        self._cd_offsets = _uint64_array()  # Offset of each central directory record
+        self._members_end = 0           # End of the laid out members
+        self._cd_size = 0               # Size of their central directory records
+        self._first_non64 = None        # First laid out member not using zip64
+
     @property
     def comment(self):
         return self._comment
@@ -408,18 +2449,138 @@ class ZipFile(object):
         if len(comment) > MAX_16BIT:
             raise ValueError("Comment must be less than {} long.".format(MAX_16BIT))
         self._comment = comment
+        self._size = None
 
     def add_from_path(self, *args, **kwargs):
+        if self.crc_cache is not None:
+            kwargs.setdefault('crc_cache', self.crc_cache)
         info = ZipInfo.from_path(*args, **kwargs)
-        self.add(info)
-        return info
+        if self.compression_policy is not None and 'compress_type' not in kwargs and info.source_path:
+            info.compress_type = self.compression_policy.choose(info.source_path, info.source_stat)
+        return self.add(info)
 
     def add_from_func(self, *args, **kwargs):
         info = ZipInfo.from_func(*args, **kwargs)
-        self.add(info)
-        return info
+        return self.add(info)
+
+    def add_from_zip(self, source_archive, names=None, prefix=''):
+        """Add members of another archive, copying their data verbatim.
+
+        ``source_archive`` is a path or a :class:`ZipReader`, and ``names``
+        the members to take (all of them by default), which are named
+        ``prefix`` + their name here. Their compressed data is copied as it
+        is, with its original CRC and sizes, so nothing is inflated or
+        compressed again and the archive's size is known up front. Returns
+        the new members.
+
+        """
+
+        reader = source_archive
+        if not isinstance(reader, ZipReader):
+            reader = ZipReader(source_archive)
+        try:
+
+            if names is None:
+                infos = reader.infolist()
+            else:
+                infos = [reader.getinfo(name) for name in names]
+
+            added = []
+            for old in infos:
+
+                if old.flag_bits & 0x1:
+                    raise ValueError("Encrypted members cannot be copied.", old.filename)
+
+                info = ZipInfo(prefix + old.filename, old.date_time)
+                for attr in ('compress_type', 'comment', 'extra', 'create_system',
+                             'internal_attr', 'external_attr',
+                             'crc', 'compress_size', 'file_size'):
+                    setattr(info, attr, getattr(old, attr))
+                # Keep the compression option bits, but we decide on data
+                # descriptors and name encoding ourselves.
+                info.flag_bits = old.flag_bits & 0x6
+                info.extract_version = max(info.extract_version, old.extract_version)
+                info.source_path = reader.path
+                info.source_offset = reader.data_offset(old)
+
+                added.append(self.add(info))
+
+        finally:
+            if reader is not source_archive:
+                reader.close()
+
+        return added
+
+    def add_tree(self, root, prefix='', include=None, exclude=None, dirs=True, workers=16, **kwargs):
+        """Add everything under the directory ``root``, returning the new members.
+
+        Members are named by their path relative to ``root`` (under
+        ``prefix``), and added in sorted depth-first order so the result is
+        deterministic. ``include`` and ``exclude`` are glob patterns (or
+        lists of them) matched against those names; files must match an
+        ``include`` (if given), and anything matching an ``exclude`` is
+        skipped, along with its contents. Directories get their own members
+        if ``dirs``, and symlinks to directories are not followed.
+
+        The tree is walked with ``os.scandir`` (or the ``scandir`` backport)
+        where available, and the ``os.stat`` calls are spread over a pool of
+        ``workers`` threads, since they dominate on network filesystems.
+        Without scandir, each directory's entries are stat'ed together on the
+        pool while walking, and those results are kept for the members.
+        Other keyword arguments are passed to :meth:`ZipInfo.from_path`.
+        With a :attr:`compression_policy`, files are sampled on the same pool.
+
+        """
+
+        if prefix and not prefix.endswith('/'):
+            prefix += '/'
+
+        found = []
+
+        def walk(path, arcdir):
+            entries = _scandir(path)
+            entries.sort(key=lambda e: e.name)
+            if exclude is not None:
+                entries = [e for e in entries if not _match_any(arcdir + e.name, exclude)]
+            if scandir is None:
+                # Telling directories apart takes an lstat per entry.
+                pool.map(_entry_lstat, entries)
+            for entry in entries:
+                arcname = arcdir + entry.name
+                if entry.is_dir(follow_symlinks=False):
+                    if dirs:
+                        found.append((entry, arcname))
+                    walk(entry.path, arcname + '/')
+                elif include is None or _match_any(arcname, include):
+                    found.append((entry, arcname))
+
+        policy = self.compression_policy
+        if 'compress_type' in kwargs:
+            policy = None
+
+        pool = ThreadPool(workers)
+        try:
+            walk(root, prefix)
+            if policy is None:
+                stats = pool.map(_entry_stat, [entry for entry, _ in found], chunksize=64)
+            else:
+                stats = pool.map(_entry_stat_policy, [(entry, policy) for entry, _ in found], chunksize=16)
+        finally:
+            pool.terminate()
+            pool.join()
+
+        if policy is None:
+            return [
+                self.add_from_path(entry.path, arcname, st=st, **kwargs)
+                for (entry, arcname), st in itertools.izip(found, stats)
+            ]
+        return [
+            self.add_from_path(entry.path, arcname, st=st, compress_type=compress_type, **kwargs)
+            for (entry, arcname), (st, compress_type) in itertools.izip(found, stats)
+        ]
 
     def add(self, info):
+        """Add a member, returning the (possibly copied) :class:`ZipInfo` now in the archive."""
 
         if not isinstance(info, ZipInfo):
             raise TypeError("Archive contents must be ZipInfo.")
@@ -429,66 +2590,657 @@ class ZipFile(object):
 
         info.assert_early_sanity()
 
-        self.infos.append(info)
-        self.info_by_name[info.filename] = info
+        if isinstance(self.infos, MemberTable):
+            info = self.infos.append(info)
+        else:
+            self.infos.append(info)
+            self.info_by_name[info.filename] = info
+        self._size = None
+        return info
 
-    def calculate_size(self, unify_zip64=False, only_members=False):
+    def precompress(self, processes=None, level=-1):
+        """Deflate members which asked for it but have no compressed data yet.
+
+        Members with ``compress_type=COMPRESSION_DEFLATE`` but no
+        ``file_size`` are compressed once (path sources on a pool of
+        ``processes``, functions in this process) and their ``crc``,
+        ``file_size`` and ``compress_size`` filled in, so the archive's size
+        is known before streaming. The compressed data is served from
+        :attr:`deflate_cache` (a :class:`DeflateCache`, created on demand),
+        which also lets later archives skip compressing unchanged files.
+        Path sources of at least :attr:`parallel_deflate_size` bytes are
+        instead split into :attr:`deflate_block_size` blocks, which are
+        compressed on ``processes`` threads. With a
+        :attr:`compression_policy`, members which deflate to no smaller than
+        they were are stored after all. Returns the number of members
+        compressed.
+
+        """
+
+        if zlib is None:
+            raise RuntimeError("Compression requires zlib.")
+
+        todo = []
+        for i, info in enumerate(self.infos):
+            if info.compress_type == COMPRESSION_DEFLATE and info.file_size is None:
+                todo.append((i, info))
+        if not todo:
+            return 0
+
+        cache = self.deflate_cache
+        if cache is None:
+            cache = self.deflate_cache = DeflateCache()
+
+        keys = []
+        try:
+            return self._precompress(todo, cache, keys, processes, level)
+        finally:
+            # The members' _DeflatedSources hold their own pins by now.
+            for key in keys:
+                cache.unpin(key)
+
+    def _precompress(self, todo, cache, keys, processes, level):
+
+        block_sizes = []
+        found = {}      # key -> (compress_size, crc, file_size)
+        paths = []
+        large = []
+        for i, info in todo:
+            block_size = None
+            if info.source_path:
+                st = info.source_stat or os.stat(info.source_path)
+                key = (os.path.abspath(info.source_path), st.st_ino, st.st_size, _stat_mtime_ns(st), level)
+                if self.parallel_deflate_size is not None and st.st_size >= self.parallel_deflate_size:
+                    block_size = self.deflate_block_size
+                    key += (block_size,)
+            else:
+                key = (info.source_func, level)
+            # So that computing later entries can't drop this one.
+            cache.pin(key)
+            keys.append(key)
+            block_sizes.append(block_size)
+            if key in found:
+                continue
+            found[key] = cache.get(key)
+            if found[key] is not None:
+                continue
+            if block_size is not None:
+                large.append((key, info.source_path))
+            elif info.source_path:
+                paths.append((key, info.source_path))
+            else:
+                data, crc, file_size = _deflate(info._iter_source_func(), level)
+                cache.put(key, data, crc, file_size)
+                found[key] = len(data), crc, file_size
+
+        if paths:
+            pool = Pool(processes) if processes != 1 and len(paths) > 1 else None
+            try:
+                args = [(path, level) for key, path in paths]
+                results = pool.imap(_deflate_path, args) if pool else itertools.imap(_deflate_path, args)
+                for (key, path), (data, crc, file_size) in itertools.izip(paths, results):
+                    cache.put(key, data, crc, file_size)
+                    found[key] = len(data), crc, file_size
+            finally:
+                if pool is not None:
+                    pool.terminate()
+                    pool.join()
+
+        for key, path in large:
+            found[key] = _deflate_large(cache, key, path, level, processes, self.deflate_block_size)
+
+        for (i, info), key, block_size in itertools.izip(todo, keys, block_sizes):
+            compress_size, crc, file_size = found[key]
+            if self.compression_policy is not None and compress_size >= file_size:
+                # The policy guessed wrong; at least we've learned the CRC.
+                cache.discard(key)
+                info.compress_type = COMPRESSION_NONE
+                info.compress_size = file_size
+                info.crc = crc
+                info.file_size = file_size
+                continue
+            info.source_func = _DeflatedSource(cache, key,
+                info.source_path or info.source_func, level, crc, block_size)
+            info.source_path = None
+            info.compress_size = compress_size
+            info.crc = crc
+            info.file_size = file_size
+
+        self.invalidate(todo[0][1])
+        return len(todo)
+
+    def precompute_crcs(self, workers=4):
+        """Compute the missing CRCs of path members on a pool of threads.
+
+        Both reading and ``crc32`` of large buffers release the GIL, so this
+        can keep several disks busy. Call it before :meth:`calculate_size` so
+        that those members don't need data descriptors. Returns the number of
+        CRCs computed.
+
+        """
+
+        todo = [info for info in self.infos if info.crc is None and info.source_path]
+        if not todo:
+            return 0
+
+        pool = ThreadPool(workers)
+        try:
+            pool.map(ZipInfo.compute_crc, todo, chunksize=1)
+        finally:
+            pool.terminate()
+            pool.join()
+
+        return len(todo)
+
+    def save_manifest(self, path):
+        """Save the archive's finalized layout to a manifest file.
+
+        The manifest records every member's name, offsets, sizes, CRC, flags,
+        source path and identity, plus the archive comment, so that
+        :meth:`load_manifest` can serve the archive (via :meth:`iter`,
+        :meth:`iter_range`, etc.) without statting or laying anything out.
+        Requires a prior :meth:`calculate_size`, and members with function
+        sources cannot be saved.
+
+        """
+        if self._size is None:
+            raise RuntimeError("Archive layout is unknown; call calculate_size().")
+        _write_manifest(path, self)
 
-        all_use_64 = True
-        self._pos = 0
+    @classmethod
+    def load_manifest(cls, path):
+        """Open an archive from a manifest written by :meth:`save_manifest`.
+
+        The manifest is memory-mapped and read lazily (see
+        :class:`ManifestTable`), so this takes constant time. Members can't be
+        added to the result.
+
+        """
+        table = ManifestTable(path)
+        self = cls()
+        self.infos = table
+        self.info_by_name = _MemberNames(table)
+        self.comment = table.comment
+        self._offsets = table.column('header_offset')
+        self._cd_offsets = table.column('cd_offset')
+        self._members_end = table.members_end
+        self._cd_size = table.cd_size
+        self._first_non64 = table.first_non64
+        self._size = table.size
+        return self
 
-        for info in self.infos:
-            info.header_offset = self._pos
+    def reuse_from(self, archive_path, manifest_path):
+        """Reuse unchanged members' data from a previous build of the archive.
+
+        ``manifest_path`` is the manifest saved (see :meth:`save_manifest`)
+        for the archive at ``archive_path``. Every path member whose name,
+        source path, and source identity (inode, size, mtime) match that
+        manifest, and whose CRC was known, takes the old CRC without reading
+        its source, and its data is copied out of the old archive instead.
+        Call this before :meth:`calculate_size`, and don't replace the old
+        archive until the new one is written. Returns the number of members
+        reused.
+
+        """
+
+        old = ManifestTable(manifest_path)
+        try:
+
+            if os.path.getsize(archive_path) != old.size:
+                raise ValueError("Archive does not match its manifest.", archive_path)
+
+            reused = 0
+            for info in self.infos:
+
+                st = info.source_stat
+                if not info.source_path or st is None or info.compress_type != COMPRESSION_NONE:
+                    continue
+                prev = old.lookup(info.filename)
+                if prev is None or prev.crc is None or prev.source_path != info.source_path:
+                    continue
+                prev_st = prev.source_stat
+                if prev_st is None or (
+                    (prev_st.st_ino, prev_st.st_size, prev_st.st_mtime_ns) !=
+                    (st.st_ino, st.st_size, _stat_mtime_ns(st))
+                ):
+                    continue
+                if prev.compress_type != COMPRESSION_NONE or prev.compress_size != info.compress_size:
+                    continue
+
+                info.crc = prev.crc
+                info.reuse_path = archive_path
+                info.reuse_offset = prev.header_offset + prev.local_file_header_size()
+                reused += 1
+
+        finally:
+            old.close()
+
+        return reused
+
+    def invalidate(self, info=None):
+        """Forget the layout of ``info`` (or every member) and all after it.
+
+        Call this after changing a member which has already been through
+        :meth:`calculate_size`; the next call will lay out that suffix again.
+
+        """
+        index = 0 if info is None else self.infos.index(info)
+        if isinstance(self._offsets, _ManifestColumn):
+            # Loaded from a manifest; we need our own copy to change it.
+            self._offsets = _uint64_array(self._offsets)
+            self._cd_offsets = _uint64_array(self._cd_offsets)
+        if index < len(self._offsets):
+            self._members_end = self._offsets[index]
+            self._cd_size = self._cd_offsets[index]
+            del self._offsets[index:]
+            del self._cd_offsets[index:]
+            if self._first_non64 is not None and self._first_non64 >= index:
+                self._first_non64 = None
+        self._size = None
+
+    def _layout_members(self):
+
+        offsets = self._offsets
+        cd_offsets = self._cd_offsets
+        pos = self._members_end
+        cd_size = self._cd_size
+        first_non64 = self._first_non64
+
+        infos = self.infos
+        for i in xrange(len(offsets), len(infos)):
+            info = infos[i]
+            info.header_offset = pos
             info.finalize()
             info.assert_late_sanity()
-            self._pos += len(info.dumps_local_file_header())
-            self._pos += info.compress_size
-            self._pos += len(info.dumps_data_descriptor())
-            all_use_64 = all_use_64 and info.use_zip64
+            offsets.append(pos)
+            cd_offsets.append(cd_size)
+            pos += info.local_file_header_size()
+            pos += info.compress_size
+            pos += info.data_descriptor_size()
+            cd_size += info.central_directory_header_size()
+            if first_non64 is None and not info.use_zip64:
+                first_non64 = i
+
+        self._members_end = pos
+        self._cd_size = cd_size
+        self._first_non64 = first_non64
 
-        if unify_zip64 and not all_use_64 and (self._pos > MAX_32BIT or len(self.infos) > MAX_16BIT):
+    def calculate_size(self, unify_zip64=False, only_members=False):
+        """Lay out the archive and return its size in bytes.
+
+        Only members added since the last call (or forgotten by
+        :meth:`invalidate`) are laid out; the others keep their offsets.
+
+        WARNING: changing anything that affects a member's size (its name,
+        ``extra``, ``comment``, ``compress_size``, ``crc``, ``use_zip64``,
+        ...) after it has been laid out is NOT noticed. Call
+        :meth:`invalidate` with that member first, or this returns a stale
+        size, and :meth:`iter_range`, :meth:`plan_parts` and
+        :meth:`write_parallel` produce a broken archive.
+
+        """
+
+        # Header sizes are computed arithmetically rather than packed.
+        self._layout_members()
+
+        first_non64 = self._first_non64
+        if unify_zip64 and first_non64 is not None and (self._members_end > MAX_32BIT or len(self.infos) > MAX_16BIT):
             # N.B.: We're not checking the central directory size here.
             # TODO: Do so.
-            for info in self.infos:
-                info.use_zip64 = True
-            self.calculate_size(only_members=True) # Reset the _pos up to here.
+            for i in xrange(first_non64, len(self.infos)):
+                self.infos[i].use_zip64 = True
+            self.invalidate(self.infos[first_non64])
+            self._layout_members()
 
-        if only_members: # Effectively a recursion check for unify_zip64.
+        self._pos = self._members_end
+        if only_members:
             return
 
-        for x in self.iter_central_directory():
-            self._pos += len(x)
+        self._pos += self._cd_size + sizeEndCentDir + len(self._comment)
+        if (
+            # Must match the ZIP64 test in iter_central_directory.
+            len(self.infos)   >= MAX_16BIT or
+            self._members_end >= MAX_32BIT or
+            self._cd_size     >= MAX_32BIT
+        ):
+            self._pos += sizeEndCentDir64 + sizeEndCentDir64Locator
 
+        self._size = self._pos
         return self._pos
 
     def _iter(self):
 
         self._pos = 0
 
-        for info in self.infos:
-            info.finalize()
-            info.assert_late_sanity()
-            info.header_offset = self._pos
-            for x in info.iter_main():
-                yield x
+        hooks = self.hooks
+
+        readahead = None
+        if self.readahead:
+            readahead = _ReadAhead(self.infos, self.readahead, self.chunk_size, self.readahead_bytes)
+
+        try:
+            for i, info in enumerate(self.infos):
+                info.finalize()
+                info.assert_late_sanity()
+                info.header_offset = self._pos
+                source = None
+                if readahead is not None and info.source_path:
+                    source = readahead.iter_source(i)
+                elif self.io_service is not None and info.source_path:
+                    source = self.io_service.iter_file(*info._source_location())
+                if hooks is None:
+                    chunks = info.iter_main(self.chunk_size, source)
+                else:
+                    chunks = self._iter_member_hooked(hooks, info, source)
+                for x in chunks:
+                    yield x
+        finally:
+            if readahead is not None:
+                readahead.close()
+
         for x in self.iter_central_directory():
             yield x
 
+        if hooks is not None:
+            hooks.archive_end(self)
+
+    def _iter_member_hooked(self, hooks, info, source):
+
+        clock = time.time
+        start = clock()
+        stats = MemberStats()
+        hooks.member_start(info)
+
+        if source is None:
+            source = info._iter_raw_source(self.chunk_size)
+        source = _iter_timed(source, stats)
+
+        yielded = None
+        try:
+            for x in info.iter_main(self.chunk_size, source, stats):
+                stats.bytes += len(x)
+                yielded = clock()
+                yield x
+                stats.consumer_time += clock() - yielded
+                yielded = None
+            stats.complete = True
+        finally:
+            end = clock()
+            if yielded is not None:
+                # Closed while the consumer held the generator.
+                stats.consumer_time += end - yielded
+            stats.total_time = end - start
+            hooks.member_end(info, stats)
+
     def iter(self):
         for chunk in self._iter():
             self._pos += len(chunk)
             yield chunk
 
-    def iter_central_directory(self):
+    def iter_coalesced(self, target_size=64 * 1024):
+        """Like :meth:`iter`, but joining small chunks into ``target_size`` ones.
 
-        cent_dir_count = len(self.infos)
-        cent_dir_offset = self._pos
+        Headers, data descriptors and small members are joined, so consumers
+        writing to a socket make fewer, larger writes. Chunks of at least
+        ``target_size`` bytes are yielded as they are, never copied.
+
+        """
+        for batch in self._iter_batches(target_size):
+            yield batch[0] if len(batch) == 1 else ''.join(batch)
+
+    def iter_vectors(self, target_size=64 * 1024):
+        """Like :meth:`iter_coalesced`, but yielding lists of chunks.
+
+        Nothing is copied; each list (``target_size`` bytes or more, except
+        the last) suits a single vectored write such as ``writev``.
+
+        """
+        return self._iter_batches(target_size)
+
+    def _iter_batches(self, target_size):
+        batch = []
+        size = 0
+        # _pos must advance as _iter produces each chunk, as it reads it to
+        # set the next member's header_offset.
+        for chunk in self._iter():
+            length = len(chunk)
+            self._pos += length
+            if not length:
+                continue
+            if length >= target_size:
+                if batch:
+                    yield batch
+                    batch = []
+                    size = 0
+                yield [chunk]
+                continue
+            batch.append(chunk)
+            size += length
+            if size >= target_size:
+                yield batch
+                batch = []
+                size = 0
+        if batch:
+            yield batch
+
+    def open(self):
+        """Return a :class:`ZipStream` file object reading :meth:`iter`."""
+        return ZipStream(self.iter())
+
+    def write_to(self, out):
+        """Write the whole archive to a file descriptor, file, or socket.
+
+        Headers are written from Python, but path sources with a known CRC
+        are copied with :meth:`ZipInfo.copy_source_to` (i.e. ``sendfile``
+        when possible). Members that need their CRC computed on the fly go
+        through the usual generator. Returns the number of bytes written.
+
+        """
+
+        if isinstance(out, (int, long)):
+            fd = out
+        else:
+            if hasattr(out, 'flush'):
+                out.flush()
+            fd = out.fileno()
+
+        self._pos = 0
 
         for info in self.infos:
-            yield info.dumps_central_directory_header()
+            info.finalize()
+            info.assert_late_sanity()
+            info.header_offset = self._pos
+            if info.source_path and info.crc is not None:
+                header = info.dumps_local_file_header()
+                _write_all(fd, header)
+                self._pos += len(header)
+                self._pos += info.copy_source_to(fd)
+                descriptor = info.dumps_data_descriptor()
+                _write_all(fd, descriptor)
+                self._pos += len(descriptor)
+            else:
+                for chunk in info.iter_main(self.chunk_size):
+                    _write_all(fd, chunk)
+                    self._pos += len(chunk)
+
+        for chunk in self.iter_central_directory():
+            _write_all(fd, chunk)
+            self._pos += len(chunk)
+
+        return self._pos
+
+    def write_parallel(self, path, workers=4):
+        """Write the whole archive to the file at ``path`` from several threads.
+
+        Since :meth:`calculate_size` fixes every member's offset up front,
+        members are independent: the file is preallocated, then ``workers``
+        threads, each with its own descriptor, seek to their members' offsets
+        and write them as :meth:`write_to` would. The central directory is
+        written last, once every CRC is known. Returns the archive size. If
+        anything fails, the partly written file is removed. The layout is
+        trusted as is; see the warning in :meth:`calculate_size`.
+
+        """
+
+        if self._size is None:
+            raise RuntimeError("Archive layout is unknown; call calculate_size().")
+
+        size = self._size
+        offsets = self._offsets
+        infos = self.infos
+        local = threading.local()
+        fds = []
+        fds_lock = threading.Lock()
+
+        def get_fd():
+            fd = getattr(local, 'fd', None)
+            if fd is None:
+                fd = local.fd = os.open(path, os.O_WRONLY)
+                with fds_lock:
+                    fds.append(fd)
+            return fd
+
+        def write_member(i):
+            info = infos[i]
+            fd = get_fd()
+            os.lseek(fd, offsets[i], os.SEEK_SET)
+            written = 0
+            if info.source_path and info.crc is not None:
+                header = info.dumps_local_file_header()
+                _write_all(fd, header)
+                written += len(header)
+                written += info.copy_source_to(fd)
+                descriptor = info.dumps_data_descriptor()
+                _write_all(fd, descriptor)
+                written += len(descriptor)
+            else:
+                for chunk in info.iter_main(self.chunk_size):
+                    _write_all(fd, chunk)
+                    written += len(chunk)
+            end = offsets[i + 1] if i + 1 < len(offsets) else self._members_end
+            if offsets[i] + written != end:
+                raise RuntimeError("Member size doesn't match the layout.", info.filename)
+
+        fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0666)
+        ok = False
+        try:
+            os.ftruncate(fd, size)
+            if posix_fallocate is not None and size:
+                posix_fallocate(fd, 0, size)
+
+            pool = ThreadPool(workers)
+            try:
+                # Biggest first, so one huge member doesn't start last.
+                order = sorted(xrange(len(infos)), key=lambda i: -infos[i].compress_size)
+                for _ in pool.imap_unordered(write_member, order):
+                    pass
+            finally:
+                # Workers must be done writing before their fds are closed.
+                pool.terminate()
+                pool.join()
+                for x in fds:
+                    os.close(x)
+
+            self._pos = self._members_end
+            os.lseek(fd, self._pos, os.SEEK_SET)
+            for chunk in self.iter_central_directory():
+                _write_all(fd, chunk)
+                self._pos += len(chunk)
+            ok = True
+        finally:
+            os.close(fd)
+            if not ok:
+                os.unlink(path)
+
+        return self._pos
+
+    def iter_range(self, start, end=None):
+        """Yield the bytes ``[start, end)`` of the archive.
+
+        Only the members overlapping the range are generated, and path sources
+        are read from the required offset, so serving the tail of a huge
+        archive is cheap. Requires a prior :meth:`calculate_size`, whose
+        layout is trusted as is; see the warning there.
+
+        """
+
+        if self._size is None:
+            raise RuntimeError("Archive layout is unknown; call calculate_size().")
+        if end is None or end > self._size:
+            end = self._size
+        if start < 0:
+            raise ValueError("Range must not start before zero.", start)
+        if start >= end:
+            return
+
+        first = max(bisect.bisect_right(self._offsets, start) - 1, 0)
+        for i in xrange(first, len(self.infos)):
+            info = self.infos[i]
+            if info.header_offset >= end:
+                return
+            for chunk in info.iter_range(start - info.header_offset,
+                                         end - info.header_offset,
+                                         self.chunk_size, self.io_service):
+                yield chunk
+
+        members_end = self._members_end
+        if end <= members_end:
+            return
+
+        # The central directory needs every CRC, including those we would
+        # normally only learn by streaming the members.
+        for info in self.infos:
+            if info.crc is None:
+                info.compute_crc()
+
+        cent_dir = self.iter_central_directory(members_end)
+        for chunk in _iter_slice(cent_dir, max(start - members_end, 0), end - members_end):
+            yield chunk
+
+    def plan_parts(self, part_size):
+        """Split the archive into ``part_size`` byte :class:`ArchivePart` objects.
+
+        The last part may be smaller. Requires a prior :meth:`calculate_size`,
+        whose layout is trusted as is (see the warning there). Parts covering data descriptors or the central directory need CRCs;
+        call :meth:`precompute_crcs` first so that they don't each compute
+        the missing ones while generating.
 
-        cent_dir_64_offset = self._pos
-        cent_dir_size = cent_dir_64_offset - cent_dir_offset
+        """
+
+        if self._size is None:
+            raise RuntimeError("Archive layout is unknown; call calculate_size().")
+        if part_size <= 0:
+            raise ValueError("Part size must be positive.", part_size)
+
+        return [
+            ArchivePart(self, number, start, min(start + part_size, self._size))
+            for number, start in enumerate(xrange(0, self._size, part_size), 1)
+        ]
+
+    def iter_central_directory(self, offset=None):
+
+        cent_dir_count = len(self.infos)
+        cent_dir_offset = self._pos if offset is None else offset
+        cent_dir_size = 0
+
+        # Records are packed with precompiled structs and yielded joined into
+        # chunks of about 1 MiB, rather than one tiny string each.
+        records = []
+        size = 0
+        for info in self.infos:
+            record = info.dumps_central_directory_header()
+            records.append(record)
+            size += len(record)
+            if size >= 1024 * 1024:
+                yield ''.join(records)
+                cent_dir_size += size
+                records = []
+                size = 0
+        if records:
+            yield ''.join(records)
+            cent_dir_size += size
+
+        cent_dir_64_offset = cent_dir_offset + cent_dir_size
         
         if (
             # The spec requires ZIP64 if any of these are >, but we're testing
@@ -500,14 +3252,13 @@ class ZipFile(object):
             cent_dir_size   >= MAX_32BIT
         ):
             # Write the ZIP64 end-of-archive records
-            zip64endrec = struct.pack(
-                    structEndArchive64, stringEndArchive64,
+            zip64endrec = _EndArchive64.pack(
+                    stringEndArchive64,
                     44, 45, 45, 0, 0, cent_dir_count, cent_dir_count,
                     cent_dir_size, cent_dir_offset)
             yield zip64endrec
 
-            zip64locrec = struct.pack(
-                    structEndArchive64Locator,
+            zip64locrec = _EndArchive64Locator.pack(
                     stringEndArchive64Locator, 0, cent_dir_64_offset, 1)
             yield zip64locrec
 
@@ -515,7 +3266,7 @@ class ZipFile(object):
             cent_dir_size   = MAX_32BIT
             cent_dir_offset = MAX_32BIT
 
-        endrec = struct.pack(structEndArchive, stringEndArchive,
+        endrec = _EndArchive.pack(stringEndArchive,
                             0, 0, cent_dir_count, cent_dir_count,
                             cent_dir_size, cent_dir_offset, len(self._comment))
 
@@ -524,6 +3275,310 @@ class ZipFile(object):
             yield self._comment
 
 
+def _extract_path(root, name):
+    """Return where to extract the member ``name`` under ``root``, or None.
+
+    Absolute paths, drive letters, and ``.`` and ``..`` components are
+    dropped, so nothing lands outside ``root``.
+
+    """
+    name = name.replace('\\', '/')
+    parts = [x for x in name.split('/') if x not in ('', '.', '..')]
+    if parts:
+        parts[0] = os.path.splitdrive(parts[0])[1]
+    parts = [x for x in parts if x]
+    if not parts:
+        return None
+    return os.path.join(root, *parts)
+
+
+class ZipReader(object):
+    """Random access to the members of an existing archive, via ``mmap``.
+
+    Only the end records are parsed up front; the central directory is
+    indexed by name the first time a member is looked up. Stored members can
+    be had as zero-copy buffers over the mapping, and deflated ones are
+    inflated as they stream. Members are described by :class:`ZipInfo`.
+
+    """
+
+    def __init__(self, path):
+        import mmap
+        self.path = path
+        with open(path, 'rb') as fh:
+            size = os.fstat(fh.fileno()).st_size
+            if size < sizeEndCentDir:
+                raise ValueError("File is too small to be a ZIP archive.", path)
+            self._mmap = mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ)
+        self._index = None
+        self._read_end_records()
+
+    def close(self):
+        self._mmap.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def _read_end_records(self):
+
+        mm = self._mmap
+        end = mm.rfind(stringEndArchive, max(0, len(mm) - sizeEndCentDir - MAX_16BIT))
+        if end < 0:
+            raise ValueError("No end of central directory record; not a ZIP archive?", self.path)
+
+        (
+            _, disk, cd_disk, _, count, cd_size, cd_offset, comment_len
+        ) = _EndArchive.unpack_from(mm, end)
+        self.comment = mm[end + sizeEndCentDir:end + sizeEndCentDir + comment_len]
+
+        locator = end - sizeEndCentDir64Locator
+        if locator >= 0 and mm[locator:locator + 4] == stringEndArchive64Locator:
+            _, _, end64, _ = _EndArchive64Locator.unpack_from(mm, locator)
+            if mm[end64:end64 + 4] != stringEndArchive64:
+                raise ValueError("Bad ZIP64 end of central directory record.", self.path)
+            (
+                _, _, _, _, _, _, _, count, cd_size, cd_offset
+            ) = _EndArchive64.unpack_from(mm, end64)
+
+        self.count = count
+        self.cd_offset = cd_offset
+        self.cd_size = cd_size
+
+    def _iter_records(self):
+        """Yield ``(offset, encoded_name)`` for each central directory record."""
+        mm = self._mmap
+        pos = self.cd_offset
+        for i in xrange(self.count):
+            if mm[pos:pos + 4] != stringCentralDir:
+                raise ValueError("Bad central directory record.", pos)
+            name_len, extra_len, comment_len = struct.unpack_from('<3H', mm, pos + 28)
+            start = pos + sizeCentralDir
+            yield pos, mm[start:start + name_len]
+            pos = start + name_len + extra_len + comment_len
+
+    def _build_index(self):
+        index = {}
+        for offset, name in self._iter_records():
+            index[name] = offset
+        self._index = index
+
+    def _parse_record(self, pos):
+
+        mm = self._mmap
+        (
+            _, create_version, create_system, extract_version, reserved,
+            flag_bits, compress_type, dostime, dosdate,
+            CRC, compress_size, file_size,
+            name_len, extra_len, comment_len,
+            volume, internal_attr, external_attr, header_offset,
+        ) = _CentralDir.unpack_from(mm, pos)
+
+        pos += sizeCentralDir
+        filename = mm[pos:pos + name_len]
+        pos += name_len
+        extra = mm[pos:pos + extra_len]
+        pos += extra_len
+        comment = mm[pos:pos + comment_len]
+
+        if flag_bits & 0x800:
+            filename = filename.decode('utf-8')
+
+        info = ZipInfo(filename, _dos_to_date_time(dosdate, dostime))
+        info.create_version = create_version
+        info.create_system = create_system
+        info.extract_version = extract_version
+        info.reserved = reserved
+        info.flag_bits = flag_bits
+        info.compress_type = compress_type
+        info.crc = CRC
+        info.volume = volume
+        info.internal_attr = internal_attr
+        info.external_attr = external_attr
+        info.comment = comment
+
+        # Pull the real values out of a ZIP64 field, and keep the other extras.
+        other_extras = []
+        i = 0
+        while i + 4 <= len(extra):
+            tp, ln = struct.unpack_from('<HH', extra, i)
+            data = extra[i + 4:i + 4 + ln]
+            if tp == 1:
+                values = list(struct.unpack_from('<%dQ' % (ln // 8), data))
+                if file_size == MAX_32BIT and values:
+                    file_size = values.pop(0)
+                if compress_size == MAX_32BIT and values:
+                    compress_size = values.pop(0)
+                if header_offset == MAX_32BIT and values:
+                    header_offset = values.pop(0)
+                info.use_zip64 = True
+            else:
+                other_extras.append(extra[i:i + 4 + ln])
+            i += 4 + ln
+        info.extra = ''.join(other_extras)
+
+        info.file_size = file_size
+        info.compress_size = compress_size
+        info.header_offset = header_offset
+        return info
+
+    def infolist(self):
+        """Return a :class:`ZipInfo` for every member, in central directory order."""
+        return [self._parse_record(offset) for offset, _ in self._iter_records()]
+
+    def namelist(self):
+        if self._index is None:
+            self._build_index()
+        return [self.getinfo(offset).filename for offset in sorted(self._index.itervalues())]
+
+    def getinfo(self, name):
+        """Return the :class:`ZipInfo` for ``name`` (or a central directory offset)."""
+        if isinstance(name, (int, long)):
+            return self._parse_record(name)
+        if self._index is None:
+            self._build_index()
+        key = name.encode('utf-8') if isinstance(name, unicode) else name
+        try:
+            return self._parse_record(self._index[key])
+        except KeyError:
+            raise KeyError("There is no member named %r." % name)
+
+    def data_offset(self, info):
+        """Return the offset of the given member's data, from its local header."""
+        mm = self._mmap
+        pos = info.header_offset
+        if mm[pos:pos + 4] != stringFileHeader:
+            raise ValueError("Bad local file header.", info.filename)
+        name_len, extra_len = struct.unpack_from('<2H', mm, pos + 26)
+        return pos + sizeFileHeader + name_len + extra_len
+
+    def view(self, name):
+        """Return a zero-copy buffer of a stored member's data."""
+        info = name if isinstance(name, ZipInfo) else self.getinfo(name)
+        if info.compress_type != COMPRESSION_NONE:
+            raise ValueError("Only stored members can be viewed; use iter_read().", info.filename)
+        return buffer(self._mmap, self.data_offset(info), info.compress_size)
+
+    def iter_raw(self, name, chunk_size=1024 * 1024):
+        """Yield zero-copy buffers of a member's data as stored (i.e. compressed)."""
+        info = name if isinstance(name, ZipInfo) else self.getinfo(name)
+        start = self.data_offset(info)
+        end = start + info.compress_size
+        for pos in xrange(start, end, chunk_size):
+            yield buffer(self._mmap, pos, min(chunk_size, end - pos))
+
+    def iter_read(self, name, chunk_size=1024 * 1024, check_crc=True):
+        """Yield a member's uncompressed data, inflating it as we go.
+
+        With ``check_crc``, raises ValueError at the end if the CRC is wrong.
+
+        """
+
+        info = name if isinstance(name, ZipInfo) else self.getinfo(name)
+        if info.compress_type == COMPRESSION_NONE:
+            decompressor = None
+        elif info.compress_type == COMPRESSION_DEFLATE:
+            decompressor = zlib.decompressobj(-15)
+        else:
+            raise ValueError("Unsupported compression type %d." % info.compress_type, info.filename)
+
+        CRC = 0
+        for chunk in self.iter_raw(info, chunk_size):
+            if decompressor is not None:
+                chunk = decompressor.decompress(chunk)
+            if check_crc:
+                CRC = crc32(chunk, CRC) & 0xffffffff
+            yield chunk
+        if decompressor is not None:
+            chunk = decompressor.flush()
+            if check_crc:
+                CRC = crc32(chunk, CRC) & 0xffffffff
+            if chunk:
+                yield chunk
+
+        if check_crc and CRC != info.crc:
+            raise ValueError("Bad CRC-32 for member.", info.filename)
+
+    def read(self, name, check_crc=True):
+        """Return a member's uncompressed data as a string."""
+        return ''.join(str(x) for x in self.iter_read(name, check_crc=check_crc))
+
+    def extractall(self, path, members=None, workers=4, check_crc=True):
+        """Extract members (all of them by default) under the directory ``path``.
+
+        The central directory is read once, members are taken in order of
+        their offset so reads stay sequential, and each file is preallocated
+        and then inflated and CRC-checked on a pool of ``workers`` threads
+        (zlib releases the GIL). Names are sanitized as :func:`_extract_path`
+        does; members left with no name are skipped. Unix permissions and
+        modification times are restored. Returns the number of members
+        extracted.
+
+        """
+
+        if members is None:
+            infos = self.infolist()
+        else:
+            infos = [m if isinstance(m, ZipInfo) else self.getinfo(m) for m in members]
+        infos.sort(key=lambda info: info.header_offset)
+
+        # Make the directories up front, so workers don't race to.
+        todo = []
+        dirs = set()
+        for info in infos:
+            target = _extract_path(path, info.filename)
+            if target is None:
+                continue
+            if info.filename.endswith('/'):
+                dirs.add(target)
+            else:
+                dirs.add(os.path.dirname(target))
+            todo.append((info, target))
+        for target in sorted(dirs):
+            if not os.path.isdir(target):
+                os.makedirs(target)
+
+        def extract(job):
+            info, target = job
+            if not info.filename.endswith('/'):
+                fd = os.open(target, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0666)
+                try:
+                    if info.file_size:
+                        os.ftruncate(fd, info.file_size)
+                        if posix_fallocate is not None:
+                            posix_fallocate(fd, 0, info.file_size)
+                    for chunk in self.iter_read(info, check_crc=check_crc):
+                        _write_all(fd, chunk)
+                except:
+                    os.close(fd)
+                    os.unlink(target)
+                    raise
+                os.close(fd)
+            mode = info.external_attr >> 16
+            if info.create_system == 3 and mode & 0777:
+                os.chmod(target, mode & 0777)
+            mtime = time.mktime(info.date_time + (0, 0, -1))
+            os.utime(target, (mtime, mtime))
+
+        pool = ThreadPool(workers)
+        try:
+            files = [job for job in todo if not job[0].filename.endswith('/')]
+            for _ in pool.imap(extract, files, chunksize=16):
+                pass
+        finally:
+            pool.terminate()
+            pool.join()
+
+        # Directories last, as writing into them changed their mtimes.
+        for info, target in todo:
+            if info.filename.endswith('/'):
+                extract((info, target))
+
+        return len(todo)
+
+
 if __name__ == '__main__':
 
     import argparse
@@ -541,12 +3596,15 @@ if __name__ == '__main__':
     parser.add_argument('--add-large-file', action='store_true')
     parser.add_argument('--add-large-null', action='store_true')
 
+    parser.add_argument('--crc-cache')
+    parser.add_argument('--precompute-crcs', type=int, metavar='WORKERS')
+
     parser.add_argument('paths', nargs='*')
     args = parser.parse_args()
 
     content_size = 0
 
-    zipper = ZipFile()
+    zipper = ZipFile(crc_cache=SQLiteCRCCache(args.crc_cache) if args.crc_cache else None)
     for path in args.paths:
         zipper.add_from_path(path)
 
@@ -590,6 +3648,9 @@ if __name__ == '__main__':
         )
         
 
+    if args.precompute_crcs:
+        zipper.precompute_crcs(args.precompute_crcs)
+
     if args.corrupt_macs:
         for m in zipper.infos:
             m.crc = 0xbaaaaaad